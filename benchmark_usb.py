@@ -0,0 +1,394 @@
+#!/usr/bin/python3
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from datetime import datetime
+
+import register_usb
+import usb_authorization
+from usb_allowlist import AllowlistWatcher, AuthorizedDeviceIndex, SQLiteAllowlist, convert_csv_to_sqlite
+from usb_audit_log import AuditLogWriter
+
+ALLOWLIST_SIZES = [10, 100, 1000, 10000, 100000]
+LSUSB_SIZES = [10, 50, 100, 500]
+CSV_SIZES = [1000, 10000, 100000]
+TICK_SIZES = [10, 100, 500]
+
+# Import time budget for usb_authorization, as reported by python -X importtime;
+# set USB_STARTUP_TARGET_MS for slower or faster machines
+STARTUP_TARGET_MS = float(os.environ.get('USB_STARTUP_TARGET_MS', 100))
+# What usb_authorization imported at load time before the one-shot check
+# existed; importing it now must not take longer than these on the same machine
+BASELINE_IMPORTS = 'csv, smtplib, subprocess, email.mime.multipart, email.mime.text'
+# Modules that must only be imported when actually used (alerts sent, metrics served, ...)
+DEFERRED_MODULES = ['smtplib', 'email.mime.multipart', 'http.server', 'socketserver', 'cProfile',
+                    'sqlite3', 'subprocess']
+
+VENDOR_NAMES = ['Intel Corp.', 'Western Digital Technologies, Inc.', 'SanDisk Corp.',
+                'Logitech, Inc.', 'Kingston Technology', 'Realtek Semiconductor Corp.']
+
+
+def make_authorized_devices(count, seed=0):
+    """Generate a synthetic authorized device list with unique vid/pid/serial rows"""
+    rng = random.Random(seed)
+    devices = []
+    for i in range(count):
+        devices.append({
+            'vendor_id': f"{rng.randrange(0x10000):04x}",
+            'product_id': f"{i % 0x10000:04x}",
+            'serial_number': f"SN{i:08d}",
+            'manufacturer': 'Bench',
+            'product_name': f"Device {i}"
+        })
+    return devices
+
+
+def make_lsusb_output(count, seed=0):
+    """Generate plain lsusb output listing count devices"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lines.append(f"Bus {i // 127 + 1:03d} Device {i % 127 + 1:03d}: "
+                     f"ID {rng.randrange(0x10000):04x}:{rng.randrange(0x10000):04x} "
+                     f"{rng.choice(VENDOR_NAMES)} Device {i}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_authorized_csv(path, devices):
+    fieldnames = ['vendor_id', 'product_id', 'serial_number', 'manufacturer',
+                  'product_name', 'date_added', 'added_by', 'department']
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        for device in devices:
+            writer.writerow(dict(device, date_added='2025-01-01', added_by='bench', department='IT'))
+
+
+def per_call(function, min_time=0.2):
+    """Seconds per call of function, repeating until at least min_time has passed"""
+    number = 1
+    while True:
+        elapsed = timeit.timeit(function, number=number)
+        if elapsed >= min_time:
+            return elapsed / number
+        number *= 2
+
+
+class LocalSMTPStub:
+    """Minimal SMTP server on localhost that accepts and counts messages"""
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.server.connections += 1
+            self.wfile.write(b'220 benchmark stub\r\n')
+            in_data = False
+            for line in self.rfile:
+                if in_data:
+                    if line == b'.\r\n':
+                        in_data = False
+                        self.server.messages += 1
+                        self.wfile.write(b'250 OK\r\n')
+                    continue
+                command = line[:4].upper()
+                if command == b'DATA':
+                    in_data = True
+                    self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                elif command == b'QUIT':
+                    self.wfile.write(b'221 Bye\r\n')
+                    return
+                else:
+                    self.wfile.write(b'250 OK\r\n')
+
+    class Server(socketserver.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    def __init__(self):
+        self.server = self.Server(('127.0.0.1', 0), self.Handler)
+        self.server.connections = 0
+        self.server.messages = 0
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def messages(self):
+        return self.server.messages
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_lsusb_parsing(sizes=LSUSB_SIZES):
+    """Cost of parsing lsusb output in the monitor and in the registration tool"""
+    results = []
+    for size in sizes:
+        output = make_lsusb_output(size)
+        serial_lookups = []
+
+        def fake_serial_lookup(vendor_id, product_id):
+            # Stands in for one `lsusb -v` subprocess per device
+            serial_lookups.append(1)
+            return "Unknown"
+
+        register_usb.parse_lsusb_output(output, fake_serial_lookup)
+        results.append({
+            'devices': size,
+            'monitor_parse_us': per_call(lambda: usb_authorization.parse_lsusb_output(output)) * 1e6,
+            'register_parse_us': per_call(lambda: register_usb.parse_lsusb_output(output, None)) * 1e6,
+            'register_serial_subprocesses': len(serial_lookups)
+        })
+    return results
+
+
+def linear_is_authorized(authorized_devices, device):
+    """The original list scan, kept as a baseline for comparison"""
+    for auth_device in authorized_devices:
+        if (device['vendor_id'] == auth_device['vendor_id'].lower() and
+                device['product_id'] == auth_device['product_id'].lower()):
+            return True
+    return False
+
+
+def bench_allowlist_lookup(sizes=ALLOWLIST_SIZES, baseline_limit=10000, workdir=None):
+    """Time lookups (hits and misses) against allowlists of growing size"""
+    results = []
+    for size in sizes:
+        authorized_devices = make_authorized_devices(size)
+        index = AuthorizedDeviceIndex(authorized_devices)
+        hit = dict(authorized_devices[size // 2])
+        miss = {'vendor_id': 'zzzz', 'product_id': 'zzzz', 'serial_number': 'none'}
+
+        result = {
+            'entries': size,
+            'index_hit_ns': per_call(lambda: index.is_authorized(hit)) * 1e9,
+            'index_miss_ns': per_call(lambda: index.is_authorized(miss)) * 1e9,
+            'sqlite_hit_ns': None,
+            'linear_miss_ns': None
+        }
+
+        if workdir:
+            csv_path = os.path.join(workdir, f"lookup_{size}.csv")
+            db_path = os.path.join(workdir, f"lookup_{size}.db")
+            write_authorized_csv(csv_path, authorized_devices)
+            convert_csv_to_sqlite(csv_path, db_path)
+            store = SQLiteAllowlist(db_path)
+            result['sqlite_hit_ns'] = per_call(lambda: store.is_authorized(hit)) * 1e9
+            store.close()
+
+        # The linear scan gets slow quickly, so only run it on smaller lists
+        if size <= baseline_limit:
+            result['linear_miss_ns'] = per_call(lambda: linear_is_authorized(authorized_devices, miss)) * 1e9
+
+        results.append(result)
+    return results
+
+
+def bench_allowlist_load(workdir, sizes=CSV_SIZES):
+    """Time to parse authorized CSVs of growing size into an index"""
+    results = []
+    for size in sizes:
+        path = os.path.join(workdir, f"load_{size}.csv")
+        write_authorized_csv(path, make_authorized_devices(size))
+        watcher = AllowlistWatcher(path)
+        results.append({
+            'entries': size,
+            'load_ms': per_call(watcher.load, min_time=0.5) * 1e3
+        })
+    return results
+
+
+def bench_monitor_tick(workdir, sizes=TICK_SIZES, ticks=20):
+    """End-to-end scan tick latency, with every arrival unauthorized and alerts sent to a local SMTP stub"""
+    results = []
+    for size in sizes:
+        smtp = LocalSMTPStub()
+        csv_path = os.path.join(workdir, f"tick_{size}.csv")
+        write_authorized_csv(csv_path, make_authorized_devices(10))
+        system = usb_authorization.USBAuthorizationSystem(
+            csv_path,
+            email_config={'smtp_server': '127.0.0.1', 'smtp_port': smtp.port, 'use_tls': False,
+                          'sender_password': '', 'digest_window': 0.05, 'alert_burst': 1000,
+                          'max_alerts_per_hour': 1000000},
+            alert_spool_dir=os.path.join(workdir, f"spool_{size}"),
+            audit_log=AuditLogWriter(os.path.join(workdir, f"log_{size}.csv")),
+            suppression_log_file=os.path.join(workdir, f"suppressions_{size}.jsonl"))
+
+        # Two alternating device sets, so every tick sees size departures and size arrivals
+        snapshots = [usb_authorization.parse_lsusb_output(make_lsusb_output(size, seed)) for seed in (1, 2)]
+        tick = [0]
+        system.get_connected_usb_devices = lambda: snapshots[tick[0] % 2]
+
+        system.audit_log.start()
+        system.alert_dispatcher.start()
+        durations = []
+        # Silence the per-device console output while measuring
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            for tick[0] in range(ticks):
+                start = time.perf_counter()
+                system.scan_devices()
+                durations.append(time.perf_counter() - start)
+
+            system.alert_coalescer.close()
+            deadline = time.monotonic() + 30
+            while smtp.messages < system.alert_coalescer.digests_sent and time.monotonic() < deadline:
+                time.sleep(0.01)
+            delivered = time.monotonic()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            system.alert_dispatcher.stop()
+            system.audit_log.close()
+            smtp.close()
+
+        durations.sort()
+        results.append({
+            'devices': size,
+            'ticks': ticks,
+            'tick_median_ms': durations[len(durations) // 2] * 1e3,
+            'tick_max_ms': durations[-1] * 1e3,
+            'emails_delivered': smtp.messages,
+            'smtp_connections': smtp.server.connections,
+            'delivered_within_30s': delivered < deadline
+        })
+    return results
+
+
+def measure_import(modules):
+    """Import modules ('a' or 'a, b') in a fresh interpreter; returns (import ms, set of modules imported)
+
+    The time is the sum of the cumulative times of the top-level imports made
+    after interpreter startup, so modules site already loaded cost nothing.
+    """
+    # Bytecode is written even where PYTHONDONTWRITEBYTECODE is set, so repeated
+    # runs measure a warm start, as an installed monitor gets, not compilation
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {modules}"], env=env,
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError(f"could not import {modules}: {process.stderr.strip()[-200:]}")
+    cumulative_us = 0
+    started = False
+    imported = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('| imported package'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        top_level = not name[1:].startswith(' ')
+        name = name.strip()
+        imported.add(name)
+        if started and top_level:
+            cumulative_us += int(cumulative)
+        elif top_level and name == 'site':
+            started = True
+    return cumulative_us / 1000, imported
+
+
+def compare_import_ms(modules, baseline, runs):
+    """Median import ms of modules and of baseline, measured alternately so both see the same load"""
+    # The first imports may have to compile .pyc files, so they are not counted
+    measure_import(modules)
+    measure_import(baseline)
+    times, baseline_times = [], []
+    for _ in range(runs):
+        times.append(measure_import(modules)[0])
+        baseline_times.append(measure_import(baseline)[0])
+    times.sort()
+    baseline_times.sort()
+    return times[len(times) // 2], baseline_times[len(baseline_times) // 2]
+
+
+def bench_startup(runs=5, target_ms=STARTUP_TARGET_MS):
+    """Import cost of the monitor, which bounds how fast the one-shot check can start"""
+    _, imported = measure_import('usb_authorization')
+    heavy = sorted(name for name in DEFERRED_MODULES if name in imported)
+    median, baseline_median = compare_import_ms('usb_authorization', BASELINE_IMPORTS, runs)
+    return [{
+        'module': 'usb_authorization',
+        'import_median_ms': median,
+        'baseline_median_ms': baseline_median,
+        'target_ms': target_ms,
+        'within_target': median <= target_ms,
+        'eager_heavy_imports': ', '.join(heavy) or None
+    }]
+
+
+def run_benchmarks(quick=False):
+    workdir = tempfile.mkdtemp(prefix='usb_benchmark_')
+    try:
+        return {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': quick,
+            'startup': bench_startup(runs=3 if quick else 5),
+            'lsusb_parsing': bench_lsusb_parsing(LSUSB_SIZES[:2] if quick else LSUSB_SIZES),
+            'allowlist_lookup': bench_allowlist_lookup(ALLOWLIST_SIZES[:3] if quick else ALLOWLIST_SIZES,
+                                                       workdir=workdir),
+            'allowlist_load': bench_allowlist_load(workdir, CSV_SIZES[:1] if quick else CSV_SIZES),
+            'monitor_tick': bench_monitor_tick(workdir, TICK_SIZES[:1] if quick else TICK_SIZES,
+                                               ticks=5 if quick else 20)
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    if not rows:
+        return
+    columns = list(rows[0])
+    print("  ".join(f"{column:>16}" for column in columns))
+    for row in rows:
+        cells = []
+        for column in columns:
+            value = row[column]
+            if isinstance(value, float):
+                cells.append(f"{value:16.1f}")
+            else:
+                cells.append(f"{'-' if value is None else value!s:>16}")
+        print("  ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the USB monitor's scan, parse, match and alert paths")
+    parser.add_argument('--output', '-o', help="write the results as JSON to this file")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes, for a fast sanity run")
+    args = parser.parse_args()
+
+    results = run_benchmarks(quick=args.quick)
+
+    print_table("Startup (python -X importtime)", results['startup'])
+    print_table("lsusb parsing", results['lsusb_parsing'])
+    print_table("Allowlist lookup (ns per check)", results['allowlist_lookup'])
+    print_table("Allowlist CSV load", results['allowlist_load'])
+    print_table("Monitor tick (every arrival unauthorized)", results['monitor_tick'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    startup = results['startup'][0]
+    if startup['eager_heavy_imports'] or not startup['within_target']:
+        print(f"\nStartup check failed: {startup['import_median_ms']:.1f} ms import time "
+              f"(target {startup['target_ms']} ms), eagerly imported: {startup['eager_heavy_imports'] or 'none'}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
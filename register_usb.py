@@ -1,14 +1,68 @@
 #!/usr/bin/python3
+import argparse
 import csv
+import io
+import json
 import os
 import platform
 import re
-import subprocess
+import shutil
 import sys
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime
 
-def get_current_usb_devices():
+from usb_allowlist import AuthorizedDeviceIndex, add_rows_to_sqlite, is_sqlite_allowlist, row_to_entry
+from usb_ids import get_resolver
+from usb_sysfs import SYSFS_USB_ROOT, class_code, enumerate_usb_devices
+
+def lookup_lsusb_serial(vendor_id, product_id):
+    """Read a device's serial number with lsusb -v (this might require root)"""
+    import subprocess
+    serial_number = "Unknown"
+    try:
+        serial_process = subprocess.run(
+            ['lsusb', '-v', '-d', f'{vendor_id}:{product_id}'], 
+            capture_output=True, 
+            text=True
+        )
+        if serial_process.returncode == 0:
+            sn_match = re.search(r'iSerial\s+\d+\s+(\S+)', serial_process.stdout)
+            if sn_match:
+                serial_number = sn_match.group(1)
+    except Exception:
+        pass
+    return serial_number
+
+def parse_lsusb_output(output, serial_lookup=lookup_lsusb_serial):
+    """Parse the output of plain lsusb, looking up each device's serial with serial_lookup"""
+    connected_devices = []
+    lines = output.strip().split('\n')
+    
+    for line in lines:
+        # Example line: Bus 001 Device 002: ID 8087:0024 Intel Corp. Integrated Rate Matching Hub
+        match = re.search(r'ID (\w+):(\w+) (.+)', line)
+        if match:
+            vendor_id = match.group(1).lower()
+            product_id = match.group(2).lower()
+            device_name = match.group(3) if len(match.groups()) > 2 else "Unknown Device"
+            
+            # lsusb prints "<vendor> <product>" from usb.ids; split on the known vendor name
+            manufacturer, product_name = get_resolver().split_device_name(vendor_id, product_id, device_name)
+            
+            connected_devices.append({
+                'vendor_id': vendor_id,
+                'product_id': product_id,
+                'serial_number': serial_lookup(vendor_id, product_id) if serial_lookup else "Unknown",
+                'manufacturer': manufacturer,
+                'product_name': product_name
+            })
+    
+    return connected_devices
+
+def get_current_usb_devices(sysfs_root=SYSFS_USB_ROOT):
     """Get currently connected USB devices"""
+    import subprocess
     connected_devices = []
     
     if platform.system() == 'Windows':
@@ -55,48 +109,27 @@ def get_current_usb_devices():
                 print("Error parsing PowerShell output")
     
     elif platform.system() == 'Linux':
-        # Linux-specific USB detection
+        # Read sysfs directly when it is available; this also gives us the
+        # serial number without running lsusb -v for every device
+        sysfs_devices = enumerate_usb_devices(sysfs_root)
+        if sysfs_devices is not None:
+            for device in sysfs_devices:
+                connected_devices.append({
+                    'vendor_id': device['vendor_id'],
+                    'product_id': device['product_id'],
+                    'serial_number': device['serial_number'],
+                    'manufacturer': device['manufacturer'],
+                    'product_name': device['product_name'],
+                    'device_class': device['device_class'],
+                    'interface_classes': device['interface_classes']
+                })
+            return connected_devices
+        
+        # Fall back to lsusb
         process = subprocess.run(['lsusb'], capture_output=True, text=True)
         
         if process.returncode == 0:
-            lines = process.stdout.strip().split('\n')
-            
-            for line in lines:
-                # Example line: Bus 001 Device 002: ID 8087:0024 Intel Corp. Integrated Rate Matching Hub
-                match = re.search(r'ID (\w+):(\w+) (.+)', line)
-                if match:
-                    vendor_id = match.group(1).lower()
-                    product_id = match.group(2).lower()
-                    device_name = match.group(3) if len(match.groups()) > 2 else "Unknown Device"
-                    
-                    # Try to extract manufacturer and product name
-                    parts = device_name.split(' ', 1)
-                    manufacturer = parts[0] if len(parts) > 0 else "Unknown"
-                    product_name = parts[1] if len(parts) > 1 else device_name
-                    
-                    # Try to get serial number (this requires root)
-                    serial_number = "Unknown"
-                    try:
-                        # This might require root privileges
-                        serial_process = subprocess.run(
-                            ['lsusb', '-v', '-d', f'{vendor_id}:{product_id}'], 
-                            capture_output=True, 
-                            text=True
-                        )
-                        if serial_process.returncode == 0:
-                            sn_match = re.search(r'iSerial\s+\d+\s+(\S+)', serial_process.stdout)
-                            if sn_match:
-                                serial_number = sn_match.group(1)
-                    except Exception:
-                        pass
-                    
-                    connected_devices.append({
-                        'vendor_id': vendor_id,
-                        'product_id': product_id,
-                        'serial_number': serial_number,
-                        'manufacturer': manufacturer,
-                        'product_name': product_name
-                    })
+            connected_devices = parse_lsusb_output(process.stdout)
     
     elif platform.system() == 'Darwin':  # macOS
         # macOS-specific USB detection
@@ -150,36 +183,204 @@ def get_current_usb_devices():
     
     return connected_devices
 
-def add_device_to_authorized_list(device, csv_file, added_by="admin", department=""):
-    """Add a device to the authorized USB list"""
-    # Check if file exists and create with header if it doesn't
-    file_exists = os.path.isfile(csv_file)
+AUTHORIZED_FIELDNAMES = ['vendor_id', 'product_id', 'serial_number', 'manufacturer', 
+                         'product_name', 'date_added', 'added_by', 'department', 'owner']
+
+@contextmanager
+def locked_authorized_list(csv_file):
+    """Hold an exclusive lock on the authorized list while it is being rewritten"""
+    with open(csv_file + '.lock', 'a+') as lock_file:
+        if os.name == 'nt':
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def replace_file_atomically(path, data):
+    """Write data to a temporary file next to path and rename it over path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+def authorized_row(device, added_by="admin", department="", owner=""):
+    """Row of the authorized list for a device"""
+    return {
+        'vendor_id': device.get('vendor_id', '').lower(),
+        'product_id': device.get('product_id', '').lower(),
+        'serial_number': device.get('serial_number', ''),
+        'manufacturer': device.get('manufacturer', ''),
+        'product_name': device.get('product_name', ''),
+        'date_added': datetime.now().strftime('%Y-%m-%d'),
+        'added_by': device.get('added_by') or added_by,
+        'department': device.get('department') or department,
+        'owner': device.get('owner') or owner
+    }
+
+def add_devices_to_authorized_list(devices, csv_file, added_by="admin", department="", owner=""):
+    """Add devices to the authorized USB list, skipping ones that are already in it
     
-    fieldnames = ['vendor_id', 'product_id', 'serial_number', 'manufacturer', 
-                  'product_name', 'date_added', 'added_by', 'department']
+    The file is rewritten through a temporary file and a rename while holding
+    a lock, so a running monitor never reads a half-written list. A SQLite
+    allowlist (see usb_allowlist.py convert) gets the rows inserted instead.
+    Returns the rows that were added.
+    """
+    if is_sqlite_allowlist(csv_file):
+        return add_rows_to_sqlite(csv_file, [authorized_row(device, added_by, department, owner)
+                                             for device in devices])
     
-    with open(csv_file, 'a', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+    with locked_authorized_list(csv_file):
+        existing = b''
+        if os.path.isfile(csv_file):
+            with open(csv_file, 'rb') as f:
+                existing = f.read()
+        
+        existing_text = existing.decode('utf-8-sig', errors='replace')
+        reader = csv.DictReader(io.StringIO(existing_text, newline=''))
+        index = AuthorizedDeviceIndex(row_to_entry(row) for row in reader)
+        fieldnames = reader.fieldnames or AUTHORIZED_FIELDNAMES
+        
+        new_rows = []
+        for device in devices:
+            row = authorized_row(device, added_by, department, owner)
+            entry = row_to_entry(row)
+            if not entry['vendor_id'] or index.contains(entry):
+                continue
+            index.add(entry)
+            new_rows.append(row)
+        
+        if not new_rows:
+            return []
         
-        # Write header if file doesn't exist
-        if not file_exists:
+        output = io.StringIO(newline='')
+        header_changed = False
+        if 'owner' not in fieldnames and any(row['owner'] for row in new_rows):
+            # The owner column is newer than some lists; add it to the header
+            fieldnames = list(fieldnames) + ['owner']
+            header_changed = True
+        
+        writer = csv.DictWriter(output, fieldnames=fieldnames, extrasaction='ignore')
+        if not existing or header_changed:
             writer.writeheader()
+        header = output.getvalue().encode('utf-8')
+        output.seek(0)
+        output.truncate()
         
-        # Add current date
-        device['date_added'] = datetime.now().strftime('%Y-%m-%d')
-        device['added_by'] = added_by
-        device['department'] = department
+        if not existing:
+            prefix = header
+        else:
+            if header_changed:
+                # Swap only the header line; existing rows are kept byte for byte
+                newline = existing.find(b'\n')
+                existing = header + (existing[newline + 1:] if newline >= 0 else b'')
+            prefix = existing if existing.endswith(b'\n') else existing + b'\r\n'
+        for row in new_rows:
+            writer.writerow(row)
         
-        writer.writerow(device)
+        replace_file_atomically(csv_file, prefix + output.getvalue().encode('utf-8'))
     
-    return True
+    return new_rows
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python register_usb.py <authorized_usb_csv>")
+def add_device_to_authorized_list(device, csv_file, added_by="admin", department=""):
+    """Add a device to the authorized USB list; returns False if it was already there"""
+    return bool(add_devices_to_authorized_list([device], csv_file, added_by, department))
+
+def load_manifest(path):
+    """Read devices to register from a CSV or JSON manifest file"""
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith('.json'):
+            data = json.load(f)
+            # Either a list of devices or {"devices": [...]}
+            if isinstance(data, dict):
+                data = data.get('devices', [])
+            return [dict(device) for device in data]
+        return list(csv.DictReader(f))
+
+def filter_devices(devices, vendors=None, classes=None):
+    """Keep devices from the given vendors and/or with one of the given USB classes"""
+    selected = []
+    for device in devices:
+        if vendors and device.get('vendor_id', '').lower() not in vendors:
+            continue
+        if classes:
+            device_classes = {device.get('device_class', '')} | set(device.get('interface_classes') or [])
+            if not device_classes & classes:
+                continue
+        selected.append(device)
+    return selected
+
+def register_in_batch(args):
+    """Register connected devices or a manifest without prompting"""
+    if args.manifest:
+        devices = load_manifest(args.manifest)
+        source = f"manifest {args.manifest}"
+    else:
+        devices = get_current_usb_devices()
+        source = "connected devices"
+    
+    vendors = {vendor.lower() for vendor in args.vendor} if args.vendor else None
+    try:
+        classes = {class_code(value) for value in args.usb_class} if args.usb_class else None
+    except ValueError as e:
+        print(f"Error: {e}")
         sys.exit(1)
     
-    authorized_usb_csv = sys.argv[1]
+    selected = filter_devices(devices, vendors, classes)
+    print(f"Selected {len(selected)} of {len(devices)} devices from {source}")
+    
+    if args.dry_run:
+        for device in selected:
+            print(f"  {device.get('vendor_id', '')}:{device.get('product_id', '')} "
+                  f"S/N {device.get('serial_number', 'Unknown')} {device.get('product_name', '')}")
+        print("Dry run: no changes made.")
+        return
+    
+    added = add_devices_to_authorized_list(selected, args.authorized_usb_csv, added_by=args.added_by,
+                                           department=args.department, owner=args.owner)
+    print(f"✅ Added {len(added)} devices to the authorized list "
+          f"({len(selected) - len(added)} already present or invalid)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Add USB devices to the authorized list")
+    parser.add_argument('authorized_usb_csv', help="CSV file of authorized USB devices, or a SQLite database")
+    batch = parser.add_mutually_exclusive_group()
+    batch.add_argument('--all', action='store_true',
+                       help="register every connected device without prompting")
+    batch.add_argument('--manifest', help="register the devices listed in a CSV or JSON file")
+    parser.add_argument('--vendor', action='append',
+                        help="only devices from this vendor ID (can be repeated)")
+    parser.add_argument('--class', dest='usb_class', action='append',
+                        help="only devices with this USB class, e.g. hid, mass-storage or 08 (can be repeated)")
+    parser.add_argument('--department', default="", help="department for the registered devices")
+    parser.add_argument('--owner', default="", help="owner of the registered devices")
+    parser.add_argument('--added-by', default="admin", help="who is registering the devices")
+    parser.add_argument('--dry-run', action='store_true', help="show what would be registered")
+    args = parser.parse_args()
+    
+    if args.all or args.manifest:
+        register_in_batch(args)
+        return
+    
+    authorized_usb_csv = args.authorized_usb_csv
     
     print("USB Device Registration Tool")
     print("---------------------------")
@@ -230,6 +431,8 @@ def main():
             selected_device['department'] = department
             if add_device_to_authorized_list(selected_device, authorized_usb_csv):
                 print("\n✅ Device successfully added to authorized list!")
+            else:
+                print("\nThis device is already in the authorized list. No changes made.")
         else:
             print("\nOperation cancelled. No changes made.")
     
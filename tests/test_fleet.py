@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+"""Fleet agent and collector talking over a real localhost connection"""
+import asyncio
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usb_audit_log import AuditLogWriter  # noqa: E402
+from usb_fleet import (DETECTED_AT_FIELD, SEEN_IDS_SUFFIX, FleetAgent, FleetCollector,  # noqa: E402
+                       open_connection, query_stats)
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def device_event(verdict='unauthorized', vendor_id='dead', product_id='beef', **fields):
+    return dict(fields, verdict=verdict, reason='test',
+                device={'vendor_id': vendor_id, 'product_id': product_id, 'serial_number': 'S1',
+                        'device_name': 'Test Device', 'location': '1-1'})
+
+
+class FleetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.log_path = os.path.join(self.workdir, 'fleet_log.csv')
+        self.collector = None
+
+    def tearDown(self):
+        self.stop_collector()
+
+    def start_collector(self, address='127.0.0.1:0'):
+        """Serve a collector from a background event loop; returns the address it listens on"""
+        audit_log = AuditLogWriter(self.log_path, extra_fields=(DETECTED_AT_FIELD,))
+        self.collector = FleetCollector(address, audit_log, index_interval=0,
+                                        seen_ids_path=self.log_path + SEEN_IDS_SUFFIX)
+        listening = threading.Event()
+
+        async def serve():
+            self.loop = asyncio.get_running_loop()
+            self.serve_task = asyncio.current_task()
+            ready = asyncio.Event()
+            serving = asyncio.ensure_future(self.collector.serve(ready))
+            await ready.wait()
+            listening.set()
+            await serving
+
+        def run():
+            # asyncio.run also cancels the handlers of connections still open
+            try:
+                asyncio.run(serve())
+            except asyncio.CancelledError:
+                pass
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        self.assertTrue(listening.wait(10), "collector did not start listening")
+        return self.collector.bound_address()
+
+    def stop_collector(self):
+        if self.collector is None:
+            return
+        self.loop.call_soon_threadsafe(self.serve_task.cancel)
+        self.thread.join(10)
+        self.collector.close()
+        self.collector = None
+
+    def send_batch(self, address, events, seq=1):
+        """Send one raw batch and return the collector's reply"""
+        with open_connection(address, 10) as sock:
+            sock.sendall((json.dumps({'type': 'batch', 'seq': seq, 'events': events}) + '\n').encode('utf-8'))
+            with sock.makefile('rb') as reader:
+                return json.loads(reader.readline())
+
+    def logged_rows(self):
+        if not os.path.exists(self.log_path):
+            return []
+        with open(self.log_path, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_agent_batches_are_acknowledged_and_logged(self):
+        address = self.start_collector()
+        agent = FleetAgent(address, spool_dir=os.path.join(self.workdir, 'spool'), host='host-a',
+                           flush_interval=0.05)
+        agent.start()
+        self.addCleanup(agent.stop)
+        agent.submit(device_event())
+        agent.submit(device_event(product_id='f00d'))
+        agent.submit(device_event(verdict='authorized', vendor_id='8087', product_id='0024'))
+
+        self.assertTrue(wait_until(lambda: agent.sent_count == 3), "events were not acknowledged")
+        self.assertEqual(agent.spooled_count, 0)
+        stats = query_stats(address)
+        self.assertEqual(stats['verdicts'], {'unauthorized': 2, 'authorized': 1})
+        self.assertEqual(stats['hosts'], {'host-a': 3})
+        # Acknowledged rows are on disk while the collector is still running
+        rows = self.logged_rows()
+        self.assertEqual(sorted(row['product_id'] for row in rows), ['beef', 'f00d'])
+        self.assertTrue(all(row['system'] == 'host-a' and row[DETECTED_AT_FIELD] for row in rows))
+
+    def test_duplicate_ids_are_dropped_across_restarts(self):
+        address = self.start_collector()
+        event = device_event(id='host-a:boot:1', host='host-a')
+        self.assertEqual(self.send_batch(address, [event], seq=1), {'type': 'ack', 'seq': 1})
+        # An agent resends a batch whose ack it never saw
+        self.assertEqual(self.send_batch(address, [event], seq=2), {'type': 'ack', 'seq': 2})
+        self.assertEqual(query_stats(address)['duplicates'], 1)
+
+        self.stop_collector()
+        address = self.start_collector(address)
+        self.assertEqual(self.send_batch(address, [event], seq=3), {'type': 'ack', 'seq': 3})
+        self.assertEqual(query_stats(address)['duplicates'], 1)
+        self.assertEqual(len(self.logged_rows()), 1)
+
+    def test_events_are_spooled_until_the_collector_is_back(self):
+        address = self.start_collector()
+        self.stop_collector()
+
+        spool_dir = os.path.join(self.workdir, 'spool')
+        agent = FleetAgent(address, spool_dir=spool_dir, host='host-b', flush_interval=0.05,
+                           ack_timeout=2, initial_backoff=0.05, max_backoff=0.2)
+        agent.start()
+        self.addCleanup(agent.stop)
+        agent.submit(device_event())
+        agent.submit(device_event(product_id='f00d'))
+        self.assertTrue(wait_until(lambda: agent.spooled_count == 2), "events were not spooled")
+        self.assertEqual(agent.sent_count, 0)
+
+        self.start_collector(address)
+        self.assertTrue(wait_until(lambda: agent.sent_count == 2), "spooled events were not sent")
+        self.assertEqual([name for name in os.listdir(spool_dir) if name.endswith('.ndjson')], [])
+        self.assertEqual(query_stats(address)['verdicts'], {'unauthorized': 2})
+        self.assertEqual(len(self.logged_rows()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+"""Hotplug events: uevent parsing, QueueEventSource and applying events to the device snapshot"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usb_audit_log import AuditLogWriter  # noqa: E402
+from usb_authorization import USBAuthorizationSystem  # noqa: E402
+from usb_hotplug import QueueEventSource, describe_event, parse_uevent  # noqa: E402
+
+KERNEL_UEVENT = (b'add@/devices/pci0000:00/0000:00:14.0/usb1/1-2\x00ACTION=add\x00'
+                 b'DEVPATH=/devices/pci0000:00/0000:00:14.0/usb1/1-2\x00SUBSYSTEM=usb\x00'
+                 b'DEVTYPE=usb_device\x00PRODUCT=781/5567/100\x00SEQNUM=4711\x00')
+
+
+def write_device(root, port_path, vendor_id, product_id, serial):
+    path = os.path.join(root, port_path)
+    os.makedirs(path)
+    for name, value in (('idVendor', vendor_id), ('idProduct', product_id), ('serial', serial),
+                        ('manufacturer', 'Test'), ('product', 'Device')):
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(value + '\n')
+
+
+class UeventTest(unittest.TestCase):
+
+    def test_parse_kernel_uevent(self):
+        self.assertEqual(parse_uevent(KERNEL_UEVENT), {
+            'action': 'add',
+            'devpath': '/devices/pci0000:00/0000:00:14.0/usb1/1-2',
+            'subsystem': 'usb',
+            'devtype': 'usb_device',
+            'product': '781/5567/100'
+        })
+
+    def test_ignore_udev_and_malformed_messages(self):
+        self.assertIsNone(parse_uevent(b'libudev\x00\xfe\xed\xca\xfe' + KERNEL_UEVENT))
+        self.assertIsNone(parse_uevent(b'add@/devices/usb1\x00SUBSYSTEM=usb\x00'))
+
+    def test_describe_event(self):
+        self.assertEqual(describe_event(parse_uevent(KERNEL_UEVENT)), 'add 1-2')
+        self.assertEqual(describe_event({'action': 'resync', 'devpath': ''}), 'resync unknown')
+
+
+class QueueEventSourceTest(unittest.TestCase):
+
+    def test_returns_every_queued_event_at_once(self):
+        source = QueueEventSource()
+        source.put('add', '/devices/usb1/1-1')
+        source.put('remove', '/devices/usb1/1-2')
+        events = source.wait_for_events(timeout=1)
+        self.assertEqual([(event['action'], event['devpath']) for event in events],
+                         [('add', '/devices/usb1/1-1'), ('remove', '/devices/usb1/1-2')])
+        self.assertEqual(events[0]['subsystem'], 'usb')
+        self.assertEqual(events[0]['devtype'], 'usb_device')
+
+    def test_timeout_without_events(self):
+        source = QueueEventSource()
+        start = time.monotonic()
+        self.assertEqual(source.wait_for_events(timeout=0.1), [])
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_wakes_up_for_an_event_from_another_thread(self):
+        source = QueueEventSource()
+        timer = threading.Timer(0.05, source.put, args=('add', '/devices/usb1/1-3'))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        events = source.wait_for_events(timeout=5)
+        self.assertEqual([event['devpath'] for event in events], ['/devices/usb1/1-3'])
+
+
+class HotplugMonitorTest(unittest.TestCase):
+    """Events are applied by reading only the sysfs entries they name"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.root = os.path.join(self.workdir, 'devices')
+        os.makedirs(self.root)
+        write_device(self.root, '1-1', '046d', 'c31c', 'K1')
+        authorized_csv = os.path.join(self.workdir, 'authorized_usb.csv')
+        with open(authorized_csv, 'w') as f:
+            f.write("vendor_id,product_id,serial_number,manufacturer,product_name\n"
+                    "046d,c31c,K1,Logitech,Keyboard\n")
+        self.output = io.StringIO()
+        with redirect_stdout(self.output):
+            self.system = USBAuthorizationSystem(
+                authorized_csv, sysfs_root=self.root,
+                alert_spool_dir=os.path.join(self.workdir, 'spool'),
+                audit_log=AuditLogWriter(os.path.join(self.workdir, 'log.csv')),
+                suppression_log_file=os.path.join(self.workdir, 'suppressions.jsonl'))
+            self.system.email_alerts = False
+            self.system.scan_devices()
+        self.source = QueueEventSource()
+
+    def handle_queued_events(self):
+        with redirect_stdout(self.output):
+            self.system.handle_events(self.source.wait_for_events(timeout=1))
+
+    def attached_ports(self):
+        return sorted(device['port_path'] for device in self.system.device_tracker.devices.values())
+
+    def test_add_and_remove_events(self):
+        self.assertEqual(self.attached_ports(), ['1-1'])
+
+        write_device(self.root, '1-2', 'dead', 'beef', 'X1')
+        self.source.put('add', '/devices/pci0000:00/0000:00:14.0/usb1/1-2')
+        self.handle_queued_events()
+        self.assertEqual(self.attached_ports(), ['1-1', '1-2'])
+        self.assertIn("Unauthorized USB device detected: Test Device (dead:beef)", self.output.getvalue())
+
+        shutil.rmtree(os.path.join(self.root, '1-2'))
+        self.source.put('remove', '/devices/pci0000:00/0000:00:14.0/usb1/1-2')
+        self.handle_queued_events()
+        self.assertEqual(self.attached_ports(), ['1-1'])
+        self.assertIn("USB device removed: Test Device (dead:beef)", self.output.getvalue())
+
+    def test_resync_rescans_everything(self):
+        write_device(self.root, '1-4', 'dead', 'beef', 'X2')
+        self.source.put('resync')
+        self.handle_queued_events()
+        self.assertEqual(self.attached_ports(), ['1-1', '1-4'])
+
+
+if __name__ == "__main__":
+    unittest.main()
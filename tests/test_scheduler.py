@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""AdaptivePollScheduler driven by an injected clock, so no test ever sleeps"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usb_scheduler import AdaptivePollScheduler  # noqa: E402
+
+
+class FakeClock:
+    """Monotonic clock that only moves when sleep() is called"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cpu_used = 0.0
+
+    def cpu_clock(self):
+        return self.cpu_used
+
+    def tick(self, changed, cpu=0.0):
+        """A tick that used cpu seconds of CPU time"""
+        def run():
+            self.cpu_used += cpu
+            return changed
+        return run
+
+    def scheduler(self, **kwargs):
+        kwargs.setdefault('jitter', 0)
+        return AdaptivePollScheduler(clock=self.clock, sleep=self.clock.sleep, cpu_clock=self.cpu_clock, **kwargs)
+
+    def test_backs_off_while_nothing_changes(self):
+        scheduler = self.scheduler(min_interval=1, max_interval=10, backoff=2, cpu_budget=0)
+        for _ in range(5):
+            scheduler.run(self.tick(False))
+            scheduler.wait()
+        self.assertEqual(self.clock.sleeps, [2, 4, 8, 10, 10])
+
+    def test_change_resets_to_min_interval(self):
+        scheduler = self.scheduler(min_interval=1, max_interval=10, backoff=2, cpu_budget=0)
+        for changed in (False, False, True, False):
+            scheduler.run(self.tick(changed))
+            scheduler.wait()
+        self.assertEqual(self.clock.sleeps, [2, 4, 1, 2])
+
+    def test_wait_only_sleeps_for_what_is_left(self):
+        scheduler = self.scheduler(min_interval=5, max_interval=5, cpu_budget=0)
+        scheduler.run(self.tick(True))
+        self.clock.now += 3
+        scheduler.wait()
+        self.assertEqual(self.clock.sleeps, [2])
+        self.clock.now += 10
+        scheduler.wait()
+        self.assertEqual(self.clock.sleeps, [2])
+
+    def test_expensive_ticks_stretch_the_interval(self):
+        scheduler = self.scheduler(min_interval=1, max_interval=10, cpu_budget=0.01)
+        scheduler.run(self.tick(True, cpu=0.5))
+        self.assertAlmostEqual(scheduler.last_tick_cpu, 0.5)
+        # 0.5 s of CPU at a 1% budget needs 50 s between polls, past max_interval
+        self.assertAlmostEqual(scheduler.interval, 50)
+        self.assertAlmostEqual(scheduler.next_poll, self.clock.now + 50)
+
+    def test_jitter_stays_within_bounds(self):
+        scheduler = self.scheduler(min_interval=10, max_interval=10, jitter=0.1, cpu_budget=0,
+                                   rng=random.Random(1))
+        delays = [scheduler.update(changed=True) for _ in range(200)]
+        self.assertTrue(all(9 <= delay <= 11 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_fixed_interval(self):
+        scheduler = AdaptivePollScheduler.fixed(3, clock=self.clock, sleep=self.clock.sleep,
+                                                cpu_clock=self.cpu_clock)
+        for changed in (False, True, False):
+            scheduler.run(self.tick(changed, cpu=5))
+            scheduler.wait()
+        self.assertEqual(self.clock.sleeps, [3, 3, 3])
+        self.assertEqual(scheduler.describe(), "check interval: 3 seconds")
+
+    def test_invalid_intervals(self):
+        with self.assertRaises(ValueError):
+            AdaptivePollScheduler(min_interval=0)
+        with self.assertRaises(ValueError):
+            AdaptivePollScheduler(min_interval=5, max_interval=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+#!/usr/bin/python3
+"""Keeps the monitor's import cost, and so 'usb_authorization.py check' startup, within target"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_usb import BASELINE_IMPORTS, DEFERRED_MODULES, compare_import_ms, measure_import  # noqa: E402
+
+
+class StartupTest(unittest.TestCase):
+    RUNS = 5
+
+    def test_import_not_slower_than_baseline(self):
+        # Measured against the same machine rather than a fixed number of
+        # milliseconds; USB_STARTUP_TARGET_MS sets an absolute target instead
+        median, baseline = compare_import_ms('usb_authorization', BASELINE_IMPORTS, self.RUNS)
+        if 'USB_STARTUP_TARGET_MS' in os.environ:
+            target, against = float(os.environ['USB_STARTUP_TARGET_MS']), "USB_STARTUP_TARGET_MS"
+        else:
+            target, against = baseline, f"importing {BASELINE_IMPORTS}"
+        self.assertLessEqual(median, target,
+                             f"importing usb_authorization took {median:.1f} ms (median of {self.RUNS}), "
+                             f"{target:.1f} ms for {against}")
+
+    def test_heavy_modules_deferred(self):
+        _, imported = measure_import('usb_authorization')
+        eager = sorted(name for name in DEFERRED_MODULES if name in imported)
+        self.assertEqual(eager, [], "these modules must only be imported when first used")
+
+
+if __name__ == "__main__":
+    unittest.main()
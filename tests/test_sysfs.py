@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+"""Device enumeration from a fixture copy of /sys/bus/usb/devices"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import usb_ids  # noqa: E402
+from usb_sysfs import enumerate_usb_devices, read_sysfs_device  # noqa: E402
+
+USB_IDS = """# usb.ids fixture
+1d6b  Linux Foundation
+\t0002  2.0 root hub
+0781  SanDisk Corp.
+\t5567  Cruzer Blade
+C 00  (Defined at Interface level)
+"""
+
+
+def write_attributes(path, **attributes):
+    os.makedirs(path, exist_ok=True)
+    for name, value in attributes.items():
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(value + '\n')
+
+
+class SysfsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.root = os.path.join(self.workdir, 'devices')
+
+        # Root hub with string descriptors
+        write_attributes(os.path.join(self.root, 'usb1'), idVendor='1d6b', idProduct='0002',
+                         manufacturer='Linux 6.1 xhci-hcd', product='xHCI Host Controller',
+                         serial='0000:00:14.0', bDeviceClass='09', busnum='1', devpath='0')
+        # Keyboard with strings and an HID interface
+        write_attributes(os.path.join(self.root, '1-1'), idVendor='046D', idProduct='C31C',
+                         manufacturer='Logitech', product='USB Keyboard', bDeviceClass='00',
+                         busnum='1', devpath='1')
+        write_attributes(os.path.join(self.root, '1-1', '1-1:1.0'), bInterfaceClass='03')
+        # Flash drive without string descriptors or serial, behind a hub port
+        write_attributes(os.path.join(self.root, '1-2.3'), idVendor='0781', idProduct='5567',
+                         bDeviceClass='00', busnum='1', devpath='2.3')
+        write_attributes(os.path.join(self.root, '1-2.3', '1-2.3:1.0'), bInterfaceClass='08')
+        # Interfaces are also listed next to the devices, and look like devices
+        # when the interface directory carries device attributes
+        write_attributes(os.path.join(self.root, '1-1:1.0'), idVendor='046d', idProduct='c31c',
+                         bInterfaceClass='03')
+
+        ids_path = os.path.join(self.workdir, 'usb.ids')
+        with open(ids_path, 'w') as f:
+            f.write(USB_IDS)
+        resolver = usb_ids.UsbIdsResolver(path=ids_path, cache_dir=os.path.join(self.workdir, 'cache'))
+        patcher = mock.patch.object(usb_ids, '_default_resolver', resolver)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_enumerate_skips_interfaces(self):
+        devices = enumerate_usb_devices(self.root)
+        self.assertEqual([device['port_path'] for device in devices], ['1-1', '1-2.3', 'usb1'])
+
+    def test_device_attributes(self):
+        device = read_sysfs_device(os.path.join(self.root, '1-1'))
+        self.assertEqual(device['vendor_id'], '046d')
+        self.assertEqual(device['product_id'], 'c31c')
+        self.assertEqual(device['device_id'], '046d:c31c')
+        self.assertEqual(device['device_name'], 'Logitech USB Keyboard')
+        self.assertEqual(device['serial_number'], 'Unknown')
+        self.assertEqual(device['devpath'], '1')
+        self.assertEqual(device['device_class'], '00')
+        self.assertEqual(device['interface_classes'], ['03'])
+
+    def test_names_fall_back_to_usb_ids(self):
+        device = read_sysfs_device(os.path.join(self.root, '1-2.3'))
+        self.assertEqual(device['manufacturer'], 'SanDisk Corp.')
+        self.assertEqual(device['product_name'], 'Cruzer Blade')
+        self.assertEqual(device['device_name'], 'SanDisk Corp. Cruzer Blade')
+        self.assertEqual(device['interface_classes'], ['08'])
+
+    def test_string_descriptors_win_over_usb_ids(self):
+        device = read_sysfs_device(os.path.join(self.root, 'usb1'))
+        self.assertEqual(device['manufacturer'], 'Linux 6.1 xhci-hcd')
+        self.assertEqual(device['product_name'], 'xHCI Host Controller')
+        self.assertEqual(device['serial_number'], '0000:00:14.0')
+
+    def test_unknown_ids_without_strings(self):
+        write_attributes(os.path.join(self.root, '2-1'), idVendor='dead', idProduct='beef')
+        device = read_sysfs_device(os.path.join(self.root, '2-1'))
+        self.assertEqual(device['manufacturer'], 'Unknown')
+        self.assertEqual(device['product_name'], 'Unknown Device')
+        self.assertEqual(device['device_name'], 'Unknown USB Device')
+
+    def test_directories_that_are_not_devices(self):
+        os.makedirs(os.path.join(self.root, 'ghost'))
+        self.assertIsNone(read_sysfs_device(os.path.join(self.root, 'ghost')))
+        self.assertIsNone(read_sysfs_device(os.path.join(self.root, 'missing')))
+        self.assertEqual(len(enumerate_usb_devices(self.root)), 3)
+
+    def test_missing_root(self):
+        self.assertIsNone(enumerate_usb_devices(os.path.join(self.workdir, 'no-sysfs')))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,528 @@
+#!/usr/bin/python3
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from usb_metrics import ALERT_SEND_DURATION, ALERT_SEND_FAILURES, ALERTS_SENT, ALERTS_SUPPRESSED
+
+DEFAULT_SPOOL_DIR = 'alert_spool'
+# JSON Lines record of digests held back by the alert rate limit
+DEFAULT_SUPPRESSION_LOG = 'alert_suppressions.jsonl'
+# Subdirectory of the spool for alerts the mail server rejected outright
+DEAD_LETTER_DIR = 'dead'
+
+
+def is_permanent_failure(error):
+    """True when the mail server rejected this message itself (a 5xx reply), so resending cannot help
+
+    Authentication failures are 5xx too but affect every message, so they
+    are retried like connection problems until the configuration is fixed.
+    """
+    import smtplib
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPDataError, smtplib.SMTPSenderRefused)):
+        return error.smtp_code >= 500
+    return False
+
+
+def build_alert_message(email_config, detections, host, suppressed=0):
+    """Build one email alert listing unauthorized USB devices
+
+    detections is a list of (device, detection time) tuples collected by
+    the alert coalescer; suppressed is the number of earlier digests that
+    were held back by the rate limit and merged into this one.
+    """
+    # The email package is slow to import and most runs never send mail
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    # Create message
+    msg = MIMEMultipart()
+    msg['From'] = email_config['sender_email']
+    msg['To'] = email_config['recipient_email']
+    if len(detections) == 1:
+        msg['Subject'] = 'SECURITY ALERT: Unauthorized USB Device Detected'
+    else:
+        msg['Subject'] = f'SECURITY ALERT: {len(detections)} Unauthorized USB Devices Detected'
+
+    rows = "".join(
+        f"""
+            <tr>
+              <td>{detected_at}</td>
+              <td>{device['vendor_id']}</td>
+              <td>{device['product_id']}</td>
+              <td>{device['device_name']}</td>
+            </tr>"""
+        for device, detected_at in detections
+    )
+    suppressed_note = ""
+    if suppressed:
+        suppressed_note = (f"<p>{suppressed} earlier alert(s) were held back by the alert rate "
+                           f"limit and are included in this digest.</p>")
+
+    # Create message body
+    body = f"""
+    <html>
+      <body>
+        <h2>⚠️ Security Alert: Unauthorized USB Device Detected</h2>
+        <p>{len(detections)} unauthorized USB device(s) have been connected to {host}.</p>
+        <h3>Device Details:</h3>
+        <table border="1" cellpadding="4" cellspacing="0">
+          <tr>
+            <th>Detection Time</th>
+            <th>Vendor ID</th>
+            <th>Product ID</th>
+            <th>Device Name</th>
+          </tr>{rows}
+        </table>
+        <p><strong>System:</strong> {host}</p>
+        {suppressed_note}
+        <p>Please investigate this security incident immediately.</p>
+        <p><i>This is an automated message from your USB Authorization System.</i></p>
+      </body>
+    </html>
+    """
+
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
+
+class AlertDispatcher:
+    """Delivers alert emails from a background thread over one SMTP connection
+
+    Every alert is written to the spool directory before it is queued and
+    removed only after the SMTP server accepted it, so alerts that were
+    pending when the process stopped are sent on the next start. The queue
+    is bounded; when it is full the alert simply stays in the spool and is
+    picked up once the worker catches up.
+
+    A message the server rejects with a permanent (5xx) error is moved to
+    the spool's dead-letter directory. Other failures are retried with
+    backoff, but after max_attempts in a row the message goes to the back
+    of the queue so it cannot hold up the alerts behind it.
+
+    on_result, when set, is called as on_result(status, alert_id, subject,
+    error) whenever an alert is queued, delivered, fails an attempt or is
+    discarded; alert_id is the spool file name.
+    """
+
+    def __init__(self, email_config, spool_dir=DEFAULT_SPOOL_DIR, max_queue=100,
+                 idle_timeout=60, initial_backoff=1, max_backoff=300, max_attempts=3):
+        self.email_config = email_config
+        self.spool_dir = spool_dir
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.idle_timeout = idle_timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        # Shared by all messages, so an unreachable server is not hammered
+        # just because each message starts over
+        self.backoff = initial_backoff
+        self.server = None
+        self.sent_count = 0
+        self.failed_attempts = 0
+        self.dead_count = 0
+        self.on_result = None
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _report(self, status, name, subject, error=None):
+        if self.on_result is not None:
+            try:
+                self.on_result(status, name, subject, error)
+            except Exception as e:
+                print(f"Error reporting alert result: {e}")
+
+    # Spool handling
+
+    def _spool_path(self, name):
+        return os.path.join(self.spool_dir, name)
+
+    def _write_spool(self, msg):
+        """Persist a message to the spool directory and return its file name"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        name = f"{time.time():.6f}-{uuid.uuid4().hex}.json"
+        temp_path = self._spool_path(name + '.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump({
+                'from': msg['From'],
+                'to': [address.strip() for address in msg['To'].split(',')],
+                'subject': msg['Subject'],
+                'message': msg.as_string()
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._spool_path(name))
+        return name
+
+    def _try_queue(self, name):
+        """Queue a spooled alert unless it is already queued; False when the queue is full"""
+        with self._queued_lock:
+            if name in self._queued:
+                return True
+            try:
+                self.queue.put_nowait(name)
+            except queue.Full:
+                return False
+            self._queued.add(name)
+            return True
+
+    def _requeue_spool(self):
+        """Queue spooled alerts that are not queued yet, oldest first"""
+        try:
+            names = sorted(name for name in os.listdir(self.spool_dir) if name.endswith('.json'))
+        except OSError:
+            return
+        for name in names:
+            if not self._try_queue(name):
+                break
+
+    # SMTP connection
+
+    def _connect(self):
+        import smtplib
+        config = self.email_config
+        server = smtplib.SMTP(config['smtp_server'], config['smtp_port'], timeout=config.get('timeout', 30))
+        try:
+            if config.get('use_tls', True):
+                server.starttls()
+            if config.get('sender_password'):
+                server.login(config['sender_email'], config['sender_password'])
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                self.server.close()
+            self.server = None
+
+    def _deliver(self, spooled):
+        """Send one spooled message, reusing the open connection when it is still alive"""
+        if self.server is not None:
+            try:
+                self.server.noop()
+            except Exception:
+                self.server.close()
+                self.server = None
+        if self.server is None:
+            self.server = self._connect()
+        self.server.sendmail(spooled['from'], spooled['to'], spooled['message'])
+
+    def _dead_letter(self, name, subject, error):
+        """Move a spooled alert out of the delivery path, keeping it for inspection"""
+        dead_dir = self._spool_path(DEAD_LETTER_DIR)
+        try:
+            os.makedirs(dead_dir, exist_ok=True)
+            os.replace(self._spool_path(name), os.path.join(dead_dir, name))
+        except OSError as e:
+            print(f"Error moving rejected alert {name} to {dead_dir}: {e}")
+        self.dead_count += 1
+        print(f"Email alert rejected by the mail server, moved to {dead_dir}: {error}")
+        self._report('discarded', name, subject, error)
+
+    def _process(self, name):
+        """Deliver one spooled alert, retrying with backoff up to max_attempts times
+
+        Returns False when the alert is still waiting to be delivered.
+        """
+        path = self._spool_path(name)
+        try:
+            with open(path) as f:
+                spooled = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Discarding unreadable spooled alert {name}: {e}")
+            self._report('discarded', name, None, e)
+            return True
+
+        for attempt in range(1, self.max_attempts + 1):
+            if self._stop.is_set():
+                return False
+            try:
+                with ALERT_SEND_DURATION.time():
+                    self._deliver(spooled)
+            except Exception as e:
+                self.failed_attempts += 1
+                ALERT_SEND_FAILURES.inc()
+                if is_permanent_failure(e):
+                    self._dead_letter(name, spooled.get('subject'), e)
+                    return True
+                print(f"Error sending email alert (retrying in {self.backoff}s): {e}")
+                self._report('failed', name, spooled.get('subject'), e)
+                self._close()
+                if self._stop.wait(self.backoff):
+                    return False
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                continue
+
+            self.backoff = self.initial_backoff
+            self.sent_count += 1
+            ALERTS_SENT.inc()
+            print(f"Email alert delivered: {spooled.get('subject', name)}")
+            self._report('delivered', name, spooled.get('subject'))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return True
+        return False
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                name = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Nothing to send: drop the idle connection and pick up any
+                # alerts that did not fit in the queue
+                self._close()
+                self._requeue_spool()
+                continue
+
+            try:
+                done = self._process(name)
+            finally:
+                with self._queued_lock:
+                    self._queued.discard(name)
+            if not done and not self._stop.is_set():
+                # Let the alerts queued behind it go first; if the queue is
+                # full it stays in the spool and is re-queued later
+                self._try_queue(name)
+
+            if self.queue.empty():
+                self._requeue_spool()
+        self._close()
+
+    # Public API
+
+    def start(self):
+        """Start the delivery thread, re-queueing alerts left in the spool"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._requeue_spool()
+        self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the delivery thread; undelivered alerts stay in the spool"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def drain(self, timeout=30):
+        """Wait until every queued alert has been handled; returns False on timeout
+
+        Used by one-shot runs that exit right after submitting. Alerts that
+        could not be delivered in time stay in the spool for the monitor.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._queued_lock:
+                if not self._queued:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def hand_over(self, spool_dir):
+        """Move undelivered alerts into another dispatcher's spool, then remove this spool
+
+        Call after stop(). Used by one-shot runs with a spool of their own, so
+        the monitor delivers what they could not.
+        """
+        for subdirectory in (DEAD_LETTER_DIR, ''):
+            source = os.path.join(self.spool_dir, subdirectory)
+            target = os.path.join(spool_dir, subdirectory)
+            try:
+                names = [name for name in os.listdir(source) if name.endswith('.json')]
+            except OSError:
+                continue
+            if names:
+                os.makedirs(target, exist_ok=True)
+            for name in names:
+                os.replace(os.path.join(source, name), os.path.join(target, name))
+            try:
+                os.rmdir(source)
+            except OSError:
+                pass
+
+    def submit(self, msg):
+        """Spool an email message and queue it for delivery without blocking"""
+        name = self._write_spool(msg)
+        self._report('queued', name, msg['Subject'])
+        if not self._try_queue(name):
+            print("Alert queue is full; alert kept in spool for later delivery")
+        return name
+
+    def pending(self):
+        """Number of alerts waiting in the queue"""
+        return self.queue.qsize()
+
+
+class TokenBucket:
+    """Token bucket rate limiter: rate tokens per second, up to capacity"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Take one token; returns False when the bucket is empty"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def give_back(self):
+        """Return a token taken for something that did not happen"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def time_until_token(self):
+        """Seconds until the next token becomes available"""
+        self._refill()
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AlertCoalescer:
+    """Merges unauthorized detections that land close together into digest emails
+
+    The first detection for a host opens a window; everything detected on that
+    host before the window closes goes into one digest. Each host also has a
+    token bucket limiting how many digests it may send. When the bucket is
+    empty the digest is held back, counted as suppressed, and merged into the
+    next one, so no detection is dropped. Every suppression is counted in
+    usb_metrics and, when suppression_log (an AuditLogWriter for a .jsonl
+    file) is given, written there with the host, the number of detections
+    held and the host's suppressed digest count, so a record survives even
+    if the digest that would mention it is never sent.
+
+    build_message(detections, host, suppressed) must return an email message;
+    detections is a list of (device, detection time) tuples.
+    """
+
+    def __init__(self, build_message, dispatcher, window=5.0, max_per_hour=20, burst=5,
+                 clock=time.monotonic, suppression_log=None):
+        self.build_message = build_message
+        self.dispatcher = dispatcher
+        self.suppression_log = suppression_log
+        self.window = window
+        self.max_per_hour = max_per_hour
+        self.burst = burst
+        self.clock = clock
+        self.pending = {}
+        self.buckets = {}
+        self.suppressed = {}
+        self.suppressed_total = 0
+        self.digests_sent = 0
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def _schedule(self, host, delay):
+        timer = threading.Timer(delay, self.flush, args=(host,))
+        timer.daemon = True
+        self._timers[host] = timer
+        timer.start()
+
+    def submit(self, device, host):
+        """Add a detection to the host's current digest"""
+        with self._lock:
+            self.pending.setdefault(host, []).append(
+                (device, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            if host not in self._timers:
+                self._schedule(host, self.window)
+
+    def flush(self, host, force=False):
+        """Send the host's pending digest if its rate limit allows it"""
+        held = None
+        with self._lock:
+            self._timers.pop(host, None)
+            detections = self.pending.get(host)
+            if not detections:
+                return False
+
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.max_per_hour / 3600.0, self.burst, self.clock)
+                self.buckets[host] = bucket
+
+            if not force and not bucket.take():
+                self.suppressed[host] = self.suppressed.get(host, 0) + 1
+                self.suppressed_total += 1
+                ALERTS_SUPPRESSED.inc()
+                delay = max(self.window, bucket.time_until_token())
+                print(f"Alert rate limit reached for {host}: {len(detections)} detections held "
+                      f"for the next digest (suppressed digests: {self.suppressed[host]})")
+                self._schedule(host, delay)
+                held, suppressed = len(detections), self.suppressed[host]
+            else:
+                del self.pending[host]
+                suppressed = self.suppressed.pop(host, 0)
+
+        if held is not None:
+            # Written outside the lock; suppressions are rare but disk writes can be slow
+            self._record_suppression(host, held, suppressed)
+            return False
+
+        try:
+            self.dispatcher.submit(self.build_message(detections, host, suppressed))
+            self.digests_sent += 1
+            return True
+        except Exception as e:
+            print(f"Error queueing digest alert for {host}: {e}")
+        # Put the digest back ahead of anything detected meanwhile and try again
+        # after another window; when closing there is no later attempt
+        with self._lock:
+            bucket.give_back()
+            self.pending[host] = detections + self.pending.get(host, [])
+            if suppressed:
+                self.suppressed[host] = self.suppressed.get(host, 0) + suppressed
+            if not force and host not in self._timers:
+                self._schedule(host, self.window)
+        return False
+
+    def _record_suppression(self, host, held, suppressed):
+        if self.suppression_log is None:
+            return
+        try:
+            self.suppression_log.write_row({
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'event': 'alert_suppressed',
+                'system': host,
+                'held_detections': held,
+                'suppressed_digests': suppressed
+            })
+        except Exception as e:
+            print(f"Error recording suppressed alert for {host}: {e}")
+
+    def close(self):
+        """Cancel the timers and queue every pending digest regardless of rate limits"""
+        with self._lock:
+            timers = list(self._timers.values())
+            self._timers.clear()
+            hosts = list(self.pending)
+        for timer in timers:
+            timer.cancel()
+        for host in hosts:
+            self.flush(host, force=True)
@@ -0,0 +1,444 @@
+#!/usr/bin/python3
+import argparse
+import csv
+import io
+import os
+import sys
+import threading
+import time
+
+# Serial values that mean "no serial recorded" in the authorized CSV
+UNKNOWN_SERIALS = ('', 'unknown', '*')
+# product_id value that authorizes every product of a vendor
+WILDCARD = '*'
+# File extensions that select the SQLite allowlist store instead of CSV
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+ENTRY_FIELDS = ['vendor_id', 'product_id', 'serial_number', 'manufacturer', 'product_name',
+                'date_added', 'added_by', 'department']
+# Bytes before the last parsed offset that must be unchanged for an append-only reload
+TAIL_CHECK_BYTES = 256
+
+
+def normalize_serial(serial):
+    """Return the serial number, or '' when it is missing or a placeholder
+
+    Windows instance ids such as 'VID_2717&PID_FF40\\QSX8TS9D9DZ5EI6D' (as
+    register_usb records them) are reduced to the part after the last
+    backslash. When the device has no iSerial, Windows makes that part up
+    from the port, e.g. '5&1CCE3BFD&0&7'; such ids contain '&' and count as
+    no serial, so the device still matches on another port.
+    """
+    serial = (serial or '').strip().rsplit('\\', 1)[-1]
+    if '&' in serial:
+        return ''
+    return '' if serial.lower() in UNKNOWN_SERIALS else serial
+
+
+class AuthorizedDeviceIndex:
+    """Hash indexes over the authorized device list
+
+    Entries are matched most specific first:
+      1. exact (vendor_id, product_id, serial_number)
+      2. (vendor_id, product_id) for entries without a serial number
+      3. vendor-wide entries whose product_id is '*' (or empty)
+    Duplicate rows collapse onto the first entry with the same key.
+
+    A serial-bound entry only matches a device with that serial, except
+    when the device was listed by a tool that cannot read serials at all
+    (lsusb, system_profiler): such devices have no 'serial_number' key and
+    are checked on vendor and product. A device that was asked for its
+    serial and reported none does not match a serial-bound entry.
+    """
+
+    def __init__(self, entries=()):
+        self.by_serial = {}
+        self.by_product = {}
+        self.by_vendor = {}
+        # (vendor_id, product_id) of serial-bound entries, used only when the
+        # device was enumerated without any way to read serial numbers
+        self.serial_bound = {}
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self.by_serial) + len(self.by_product) + len(self.by_vendor)
+
+    def copy(self):
+        """Shallow copy, so new entries can be added without touching this index"""
+        index = AuthorizedDeviceIndex()
+        index.by_serial = dict(self.by_serial)
+        index.by_product = dict(self.by_product)
+        index.by_vendor = dict(self.by_vendor)
+        index.serial_bound = dict(self.serial_bound)
+        return index
+
+    def add(self, entry):
+        """Add one authorized device entry to the indexes"""
+        vendor_id = entry.get('vendor_id', '').strip().lower()
+        product_id = entry.get('product_id', '').strip().lower()
+        serial_number = normalize_serial(entry.get('serial_number'))
+
+        if not vendor_id:
+            return
+
+        if product_id in ('', WILDCARD):
+            self.by_vendor.setdefault(vendor_id, entry)
+        elif serial_number:
+            self.by_serial.setdefault((vendor_id, product_id, serial_number), entry)
+            self.serial_bound.setdefault((vendor_id, product_id), entry)
+        else:
+            self.by_product.setdefault((vendor_id, product_id), entry)
+
+    def contains(self, entry):
+        """True when an entry with the same vendor, product and serial is already indexed"""
+        vendor_id = entry.get('vendor_id', '').strip().lower()
+        product_id = entry.get('product_id', '').strip().lower()
+        serial_number = normalize_serial(entry.get('serial_number'))
+
+        if product_id in ('', WILDCARD):
+            return vendor_id in self.by_vendor
+        if serial_number:
+            return (vendor_id, product_id, serial_number) in self.by_serial
+        return (vendor_id, product_id) in self.by_product
+
+    def lookup(self, device):
+        """Return the matching authorized entry for a device, or None"""
+        vendor_id = device.get('vendor_id', '').lower()
+        product_id = device.get('product_id', '').lower()
+        serial_number = normalize_serial(device.get('serial_number'))
+
+        if serial_number:
+            entry = self.by_serial.get((vendor_id, product_id, serial_number))
+            if entry is not None:
+                return entry
+
+        entry = self.by_product.get((vendor_id, product_id))
+        if entry is not None:
+            return entry
+
+        if 'serial_number' not in device:
+            # The serial could not be read, so a serial-bound entry can only
+            # be checked on vendor and product
+            entry = self.serial_bound.get((vendor_id, product_id))
+            if entry is not None:
+                return entry
+
+        return self.by_vendor.get(vendor_id)
+
+    def is_authorized(self, device):
+        return self.lookup(device) is not None
+
+
+def row_to_entry(row):
+    """Convert a row of the authorized CSV into an allowlist entry"""
+    return {
+        'vendor_id': (row.get('vendor_id') or '').strip().lower(),
+        'product_id': (row.get('product_id') or '').strip().lower(),
+        'serial_number': (row.get('serial_number') or '').strip(),
+        'manufacturer': row.get('manufacturer') or '',
+        'product_name': row.get('product_name') or '',
+        'date_added': row.get('date_added') or '',
+        'added_by': row.get('added_by') or '',
+        'department': row.get('department') or '',
+        'owner': row.get('owner') or ''
+    }
+
+
+class AllowlistWatcher:
+    """Keeps an AuthorizedDeviceIndex in sync with the authorized CSV file
+
+    The file is checked by size and mtime. When it only grew (the usual
+    register_usb append) just the new rows are parsed; when it was rewritten
+    the whole file is parsed again. Either way a new index is built on the
+    side and handed over in one assignment, so readers never see a
+    half-updated index.
+    """
+
+    def __init__(self, csv_path, interval=2.0):
+        self.csv_path = csv_path
+        self.interval = interval
+        self.index = AuthorizedDeviceIndex()
+        self.fieldnames = None
+        self.offset = 0
+        self.tail = b''
+        self.signature = None
+        self.last_reload_seconds = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read_from(self, start):
+        """Read the file from start; returns (text, bytes consumed, tail bytes)"""
+        with open(self.csv_path, 'rb') as f:
+            f.seek(start)
+            data = f.read()
+
+        if start == 0:
+            return data.decode('utf-8-sig', errors='replace'), len(data), data[-TAIL_CHECK_BYTES:]
+
+        # A writer may be half way through appending a row; leave it for the next check
+        data = data[:data.rfind(b'\n') + 1]
+        tail = (self.tail + data)[-TAIL_CHECK_BYTES:]
+        return data.decode('utf-8', errors='replace'), len(data), tail
+
+    def load(self):
+        """Parse the whole file and replace the index"""
+        with self._lock:
+            start = time.perf_counter()
+            stat = os.stat(self.csv_path)
+            text, consumed, tail = self._read_from(0)
+            reader = csv.DictReader(io.StringIO(text, newline=''))
+            index = AuthorizedDeviceIndex(row_to_entry(row) for row in reader)
+
+            self.fieldnames = reader.fieldnames
+            self.offset = consumed
+            self.tail = tail
+            self.signature = (stat.st_size, stat.st_mtime_ns)
+            self.index = index
+            self.last_reload_seconds = time.perf_counter() - start
+            return index
+
+    def _file_was_appended(self, stat):
+        """True when everything parsed so far is still in place at the start of the file"""
+        if self.fieldnames is None or stat.st_size <= self.offset:
+            return False
+        if self.tail and not self.tail.endswith(b'\n'):
+            return False
+
+        with open(self.csv_path, 'rb') as f:
+            f.seek(self.offset - len(self.tail))
+            return f.read(len(self.tail)) == self.tail
+
+    def check(self):
+        """Reload if the file changed; returns (index, full_reload) or None if unchanged"""
+        try:
+            stat = os.stat(self.csv_path)
+        except OSError:
+            return None
+
+        if (stat.st_size, stat.st_mtime_ns) == self.signature:
+            return None
+
+        if not self._file_was_appended(stat):
+            return self.load(), True
+
+        with self._lock:
+            start = time.perf_counter()
+            text, consumed, tail = self._read_from(self.offset)
+            index = self.index.copy()
+            for row in csv.DictReader(io.StringIO(text, newline=''), fieldnames=self.fieldnames):
+                index.add(row_to_entry(row))
+
+            self.offset += consumed
+            self.tail = tail
+            # Only mark the file as seen once a trailing partial row has been consumed
+            if self.offset == stat.st_size:
+                self.signature = (stat.st_size, stat.st_mtime_ns)
+            self.index = index
+            self.last_reload_seconds = time.perf_counter() - start
+            return index, False
+
+    def state(self):
+        """Parsed index and file position as plain values, for a checkpoint"""
+        with self._lock:
+            index = self.index
+            return {
+                'csv_path': os.path.abspath(self.csv_path),
+                'fieldnames': self.fieldnames,
+                'offset': self.offset,
+                'tail': self.tail,
+                'signature': self.signature,
+                'index': (index.by_serial, index.by_product, index.by_vendor, index.serial_bound)
+            }
+
+    def restore(self, state):
+        """Resume from a state() taken earlier; returns False if it is for another file
+
+        The restored index reflects the file as it was when the state was
+        taken; call check() afterwards to pick up changes made since.
+        """
+        if state.get('csv_path') != os.path.abspath(self.csv_path):
+            return False
+        index = AuthorizedDeviceIndex()
+        index.by_serial, index.by_product, index.by_vendor, index.serial_bound = state['index']
+        with self._lock:
+            self.fieldnames = state['fieldnames']
+            self.offset = state['offset']
+            self.tail = state['tail']
+            self.signature = state['signature']
+            self.index = index
+        return True
+
+    def start(self, on_reload):
+        """Check the file in a background thread, calling on_reload(index, full_reload)"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    result = self.check()
+                except Exception as e:
+                    print(f"Error reloading authorized devices: {e}")
+                    continue
+                if result is not None:
+                    on_reload(*result)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='allowlist-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def is_sqlite_allowlist(path):
+    return path.lower().endswith(SQLITE_EXTENSIONS)
+
+
+class SQLiteAllowlist:
+    """Authorized devices looked up in an indexed SQLite database
+
+    Nothing is loaded into memory up front; each lookup is a primary key
+    search. It has the same lookup()/is_authorized() interface and matching
+    order as AuthorizedDeviceIndex. Changes written to the database are seen
+    by the next lookup, so no reload is needed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS authorized_devices (
+            vendor_id TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            serial_number TEXT NOT NULL,
+            manufacturer TEXT,
+            product_name TEXT,
+            date_added TEXT,
+            added_by TEXT,
+            department TEXT,
+            PRIMARY KEY (vendor_id, product_id, serial_number)
+        ) WITHOUT ROWID
+    """
+
+    def __init__(self, db_path):
+        # Imported here so CSV allowlists never load the sqlite3 module
+        import sqlite3
+        self.db_path = db_path
+        # Lookups come from the monitor loop and from background threads
+        self.connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM authorized_devices").fetchone()[0]
+
+    def _find(self, query, params):
+        with self._lock:
+            row = self.connection.execute(query, params).fetchone()
+        return dict(row) if row is not None else None
+
+    def lookup(self, device):
+        """Return the matching authorized entry for a device, or None"""
+        vendor_id = device.get('vendor_id', '').lower()
+        product_id = device.get('product_id', '').lower()
+        serial_number = normalize_serial(device.get('serial_number'))
+        exact = ("SELECT * FROM authorized_devices "
+                 "WHERE vendor_id = ? AND product_id = ? AND serial_number = ?")
+
+        if serial_number:
+            entry = self._find(exact, (vendor_id, product_id, serial_number))
+            if entry is not None:
+                return entry
+
+        entry = self._find(exact, (vendor_id, product_id, ''))
+        if entry is not None:
+            return entry
+
+        if 'serial_number' not in device:
+            # Same rule as AuthorizedDeviceIndex.lookup: only when serials cannot be read
+            entry = self._find("SELECT * FROM authorized_devices "
+                               "WHERE vendor_id = ? AND product_id = ? LIMIT 1", (vendor_id, product_id))
+            if entry is not None:
+                return entry
+
+        return self._find(exact, (vendor_id, WILDCARD, ''))
+
+    def is_authorized(self, device):
+        return self.lookup(device) is not None
+
+    def close(self):
+        self.connection.close()
+
+
+def _sqlite_entry(row):
+    """An authorized row in the normalized form a SQLite allowlist stores, or None without a vendor"""
+    entry = row_to_entry(row)
+    if not entry['vendor_id']:
+        return None
+    # Store entries in the same normalized form the lookups use
+    entry['serial_number'] = normalize_serial(entry['serial_number'])
+    if entry['product_id'] in ('', WILDCARD):
+        entry['product_id'] = WILDCARD
+        entry['serial_number'] = ''
+    return tuple(entry[field] for field in ENTRY_FIELDS)
+
+
+def add_rows_to_sqlite(db_path, rows):
+    """Add authorized rows to a SQLite allowlist, creating it if needed; returns the rows added
+
+    Rows that repeat an existing vendor/product/serial, or each other, are
+    skipped. Running monitors see the new rows on their next lookup.
+    """
+    import sqlite3
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute(SQLiteAllowlist.SCHEMA)
+        insert = (f"INSERT OR IGNORE INTO authorized_devices ({', '.join(ENTRY_FIELDS)}) "
+                  f"VALUES ({', '.join('?' for _ in ENTRY_FIELDS)})")
+        added = []
+        with connection:
+            for row in rows:
+                entry = _sqlite_entry(row)
+                if entry is not None and connection.execute(insert, entry).rowcount:
+                    added.append(row)
+        return added
+    finally:
+        connection.close()
+
+
+def convert_csv_to_sqlite(csv_path, db_path):
+    """Import an authorized CSV into a SQLite allowlist; returns (rows read, rows added)
+
+    Rows that repeat an existing vendor/product/serial are skipped, so the
+    import can be re-run and duplicate CSV rows are stored once.
+    """
+    with open(csv_path, 'r', newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.DictReader(f))
+    return len(rows), len(add_rows_to_sqlite(db_path, rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the authorized USB device store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert = subparsers.add_parser('convert', help="import an authorized CSV into a SQLite database")
+    convert.add_argument('csv_file', help="authorized USB CSV to import")
+    convert.add_argument('db_file', help=f"SQLite database to create or update ({', '.join(SQLITE_EXTENSIONS)})")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.csv_file):
+        print(f"Error: Authorized USB CSV file '{args.csv_file}' not found.")
+        sys.exit(1)
+    if not is_sqlite_allowlist(args.db_file):
+        print(f"Error: database file name must end with one of {', '.join(SQLITE_EXTENSIONS)}")
+        sys.exit(1)
+
+    rows_read, rows_added = convert_csv_to_sqlite(args.csv_file, args.db_file)
+    print(f"Read {rows_read} rows, added {rows_added} devices "
+          f"({rows_read - rows_added} duplicates or existing entries skipped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+import csv
+import getpass
+import json
+import os
+import platform
+import shutil
+import threading
+from datetime import datetime
+
+DEFAULT_LOG_FILE = 'unauthorized_usb_log.csv'
+LOG_FIELDNAMES = ['timestamp', 'vendor_id', 'product_id', 'device_name', 'system', 'user']
+FSYNC_POLICIES = ('always', 'flush', 'never')
+
+
+def current_user():
+    """Name of the user running the monitor, even without a controlling terminal"""
+    try:
+        return getpass.getuser()
+    except Exception:
+        pass
+    try:
+        return os.getlogin()
+    except OSError:
+        return 'unknown'
+
+
+def log_format_for(path):
+    """Guess the log format from the file extension"""
+    return 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+
+
+class AuditLogWriter:
+    """Long-lived writer for the unauthorized device log
+
+    Rows are buffered and written every flush_interval seconds (or when
+    max_buffer rows are waiting). fsync can be done for every row
+    ('always'), after each batch ('flush') or left to the OS ('never').
+    The log is rotated once it reaches max_bytes and/or when the date
+    changes, and rotated segments can be gzipped in the background.
+
+    extra_fields are written after the standard columns, taken from the
+    device. When appending to an existing CSV log, its header decides the
+    columns, so rows always line up with it.
+    """
+
+    def __init__(self, path=DEFAULT_LOG_FILE, log_format=None, flush_interval=1.0, fsync='flush',
+                 max_buffer=100, max_bytes=0, rotate_daily=False, compress=False, extra_fields=()):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {', '.join(FSYNC_POLICIES)}")
+
+        self.path = path
+        self.log_format = log_format or log_format_for(path)
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_buffer = max_buffer
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self.extra_fields = tuple(extra_fields)
+
+        # Identity never changes while we run, so look it up once
+        self.system = platform.node()
+        self.user = current_user()
+
+        self.buffer = []
+        self.file = None
+        self.writer = None
+        self.segment_date = None
+        self.segment_empty = True
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'a', newline='', encoding='utf-8')
+        self.segment_empty = self.file.tell() == 0
+        if self.log_format == 'csv':
+            fieldnames = LOG_FIELDNAMES + list(self.extra_fields)
+            if not self.segment_empty:
+                with open(self.path, 'r', newline='', encoding='utf-8') as f:
+                    fieldnames = next(csv.reader(f), None) or fieldnames
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, restval='', extrasaction='ignore')
+            if self.file.tell() == 0:
+                self.writer.writeheader()
+        if self.segment_date is None:
+            try:
+                self.segment_date = datetime.fromtimestamp(os.path.getmtime(self.path)).date()
+            except OSError:
+                self.segment_date = datetime.now().date()
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.writer = None
+
+    def _segment_name(self, label):
+        base, ext = os.path.splitext(self.path)
+        name = f"{base}.{label}{ext}"
+        counter = 1
+        while os.path.exists(name) or os.path.exists(name + '.gz'):
+            name = f"{base}.{label}.{counter}{ext}"
+            counter += 1
+        return name
+
+    def _rotate(self, label):
+        """Move the current log aside and start a new one"""
+        self._close_file()
+        segment = self._segment_name(label)
+        os.replace(self.path, segment)
+        if self.compress:
+            threading.Thread(target=self._compress, args=(segment,), name='audit-log-gzip').start()
+
+    @staticmethod
+    def _compress(segment):
+        import gzip
+        try:
+            with open(segment, 'rb') as src, gzip.open(segment + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(segment)
+        except OSError as e:
+            print(f"Error compressing log segment {segment}: {e}")
+
+    def _write_row(self, row):
+        if self.log_format == 'csv':
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + '\n')
+        if self.fsync == 'always':
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def _flush_locked(self):
+        rows, self.buffer = self.buffer, []
+        for row in rows:
+            if self.file is None:
+                self._open()
+            if self.rotate_daily:
+                row_date = datetime.strptime(row['timestamp'][:10], '%Y-%m-%d').date()
+                if row_date != self.segment_date:
+                    if not self.segment_empty:
+                        self._rotate(self.segment_date.isoformat())
+                        self._open()
+                    self.segment_date = row_date
+            self._write_row(row)
+            self.segment_empty = False
+
+        if self.file is None:
+            return
+        self.file.flush()
+        if self.fsync == 'flush':
+            os.fsync(self.file.fileno())
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            self._rotate(datetime.now().strftime('%Y%m%d-%H%M%S'))
+
+    def flush(self):
+        """Write buffered rows to disk"""
+        with self._lock:
+            if self.buffer:
+                self._flush_locked()
+
+    def write(self, device, timestamp=None):
+        """Buffer one unauthorized device event"""
+        row = {
+            'timestamp': timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'vendor_id': device['vendor_id'],
+            'product_id': device['product_id'],
+            'device_name': device['device_name'],
+            'system': device.get('system') or self.system,
+            'user': device.get('user') or self.user
+        }
+        for field in self.extra_fields:
+            row[field] = device.get(field) or ''
+        return self.write_row(row)
+
+    def write_row(self, row):
+        """Buffer one ready-made row; it needs a 'timestamp' in the log's format"""
+        with self._lock:
+            self.buffer.append(row)
+            if self.fsync == 'always' or len(self.buffer) >= self.max_buffer or self._thread is None:
+                self._flush_locked()
+        return row
+
+    def start(self):
+        """Flush buffered rows every flush_interval seconds from a background thread"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.flush_interval):
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error writing unauthorized device log: {e}")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='audit-log-flush', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the flush thread, write what is left and close the file"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self.buffer:
+                self._flush_locked()
+            self._close_file()
@@ -1,48 +1,214 @@
 #!/usr/bin/python3
-import csv
+import argparse
+import json
 import os
 import platform
 import re
-import smtplib
-import subprocess
 import sys
 import time
+from contextlib import redirect_stdout
 from datetime import datetime
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+
+from usb_allowlist import AllowlistWatcher, AuthorizedDeviceIndex, SQLiteAllowlist, is_sqlite_allowlist
+from usb_metrics import (ALERT_QUEUE_DEPTH, ALLOWLIST_ENTRIES, ALLOWLIST_RELOAD_DURATION, DECISIONS,
+                         DEVICE_CHANGES, DEVICES_ATTACHED, ENUMERATION_DURATION, HOTPLUG_EVENTS,
+                         SCAN_DURATION, TickProfiler, start_metrics_server, start_metrics_socket)
+from usb_policy import PolicyEngine, load_policy
+from usb_snapshot import DeviceTracker, device_identity, device_location
+from usb_sysfs import SYSFS_USB_ROOT, enumerate_usb_devices, read_sysfs_device
+
+# Alerting, logging, hotplug, checkpoint and scheduling modules are imported
+# where they are first needed, so the one-shot check starts quickly
+
+# Tool used to list devices on each platform when sysfs is not available
+ENUMERATION_TOOLS = {'Windows': 'powershell', 'Linux': 'lsusb', 'Darwin': 'system_profiler'}
+
+def run_command(command):
+    """Run an enumeration tool and capture its output"""
+    # Imported here since sysfs enumeration and one-shot checks usually never need it
+    import subprocess
+    return subprocess.run(command, capture_output=True, text=True)
+
+def parse_lsusb_output(output):
+    """Parse the output of plain lsusb into device dictionaries"""
+    connected_devices = []
+    lines = output.strip().split('\n')
+    
+    for line in lines:
+        # Example line: Bus 001 Device 002: ID 8087:0024 Intel Corp. Integrated Rate Matching Hub
+        match = re.search(r'ID (\w+):(\w+)', line)
+        address_match = re.search(r'Bus (\d+) Device (\d+)', line)
+        if match:
+            vendor_id = match.group(1).lower()
+            product_id = match.group(2).lower()
+            
+            # Extract device name if present
+            device_name = line.split(f"ID {vendor_id}:{product_id}")[-1].strip()
+            if not device_name:
+                device_name = "Unknown USB Device"
+            
+            connected_devices.append({
+                'vendor_id': vendor_id,
+                'product_id': product_id,
+                'device_name': device_name,
+                'device_id': f"{vendor_id}:{product_id}",
+                # Device numbers change on every replug, so this tells
+                # identical devices and reconnections apart
+                'usb_address': address_match.group(0) if address_match else ''
+            })
+    
+    return connected_devices
 
 class USBAuthorizationSystem:
-    def __init__(self, authorized_usb_csv):
+    def __init__(self, authorized_usb_csv, sysfs_root=SYSFS_USB_ROOT, email_config=None,
+                 alert_spool_dir=None, audit_log=None, checkpoint=None, policy=None,
+                 suppression_log_file=None):
+        from usb_alerts import DEFAULT_SPOOL_DIR, DEFAULT_SUPPRESSION_LOG, AlertCoalescer, AlertDispatcher
+        from usb_audit_log import AuditLogWriter
         self.authorized_usb_csv = authorized_usb_csv
-        self.authorized_devices = self.load_authorized_devices()
+        self.sysfs_root = sysfs_root
+        self.using_sysfs = False
+        # Raw output of the last lsusb run, kept for trace recording (see usb_replay)
+        self.last_lsusb_output = None
+        # Optional usb_replay.TraceRecorder, given the snapshot after every change
+        self.trace_recorder = None
+        # Email alerts for unauthorized devices; a replay turns them off unless asked
+        self.email_alerts = True
+        # Optional usb_metrics.TickProfiler for on-demand profiling of one tick
+        self.tick_profiler = None
+        # Optional usb_fleet.FleetAgent; when set, every verdict is reported to
+        # the fleet collector, which sends the alert emails instead of this host
+        self.fleet_agent = None
+        # Optional usb_events.EventStream publishing arrivals, departures,
+        # verdicts and alert results as JSON Lines
+        self.event_stream = None
+        # Devices attached at the last scan, used to detect arrivals and departures
+        self.device_tracker = DeviceTracker()
+        # Unauthorized devices already alerted on that have not been unplugged
+        # since, keyed by device identity, so a restart does not alert again
+        self.alert_history = {}
+        # Writer for unauthorized_usb_log.csv unless a configured one is passed in
+        self.audit_log = audit_log or AuditLogWriter()
+        # A SQLite allowlist is queried in place and needs no watcher
+        self.allowlist_watcher = None
+        if not is_sqlite_allowlist(authorized_usb_csv):
+            self.allowlist_watcher = AllowlistWatcher(authorized_usb_csv)
+        # Optional usb_checkpoint.MonitorCheckpoint to resume from and save to
+        self.checkpoint = checkpoint
+        self.authorized_index = None
+        if checkpoint is not None:
+            self.resume_from_checkpoint(checkpoint.load())
+        if self.authorized_index is None:
+            self.authorized_index = self.load_authorized_devices()
+        # Authorization rules from a policy file (see usb_policy); without one
+        # only the authorized list is consulted. SQLite lookups always see the
+        # current database, so their verdicts are not cached.
+        self.policy_engine = PolicyEngine(policy, self.authorized_index,
+                                          cache_size=0 if self.allowlist_watcher is None else 4096)
         self.email_config = {
             'smtp_server': 'smtp.gmail.com',
             'smtp_port': 587,
             'sender_email': 'kanishkaarde99@gmail.com',  # Update with your email
             'sender_password': 'bole utgq yawu rmga',  # Update with your app password
-            'recipient_email': 'kanishkaarde99@gmail.com'  # Update with recipient email
+            'recipient_email': 'kanishkaarde99@gmail.com',  # Update with recipient email
+            'use_tls': True,
+            # Detections within this many seconds are merged into one digest email
+            'digest_window': 5,
+            # Rate limit for digest emails per host
+            'max_alerts_per_hour': 20,
+            'alert_burst': 5
         }
+        if email_config:
+            self.email_config.update(email_config)
+        self.alert_dispatcher = AlertDispatcher(self.email_config, spool_dir=alert_spool_dir or DEFAULT_SPOOL_DIR)
+        # Digests held back by the rate limit; the file is only created when one is
+        self.suppression_log = AuditLogWriter(suppression_log_file or DEFAULT_SUPPRESSION_LOG, log_format='jsonl')
+        self.alert_coalescer = AlertCoalescer(
+            self.build_alert_message, self.alert_dispatcher,
+            window=self.email_config['digest_window'],
+            max_per_hour=self.email_config['max_alerts_per_hour'],
+            burst=self.email_config['alert_burst'],
+            suppression_log=self.suppression_log)
+        ALERT_QUEUE_DEPTH.set_function(self.alert_dispatcher.pending)
         
     def load_authorized_devices(self):
-        """Load authorized USB devices from CSV file"""
-        authorized_devices = []
-        
+        """Load authorized USB devices from CSV file (or SQLite database) into a lookup index"""
         try:
-            with open(self.authorized_usb_csv, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    authorized_devices.append({
-                        'vendor_id': row['vendor_id'].lower(),
-                        'product_id': row['product_id'].lower(),
-                        'serial_number': row['serial_number'],
-                        'manufacturer': row['manufacturer'],
-                        'product_name': row['product_name']
-                    })
-            print(f"Loaded {len(authorized_devices)} authorized devices")
-            return authorized_devices
+            if self.allowlist_watcher is None:
+                index = SQLiteAllowlist(self.authorized_usb_csv)
+            else:
+                index = self.allowlist_watcher.load()
+            print(f"Loaded {len(index)} authorized devices")
+            ALLOWLIST_ENTRIES.set(len(index))
+            if self.allowlist_watcher is not None:
+                ALLOWLIST_RELOAD_DURATION.observe(self.allowlist_watcher.last_reload_seconds, kind='initial')
+            return index
         except Exception as e:
             print(f"Error loading authorized devices: {e}")
-            return []
+            return AuthorizedDeviceIndex()
+    
+    def resume_from_checkpoint(self, state):
+        """Restore the alert history and allowlist from a checkpoint; attached devices are rescanned"""
+        if not state:
+            return False
+        
+        self.alert_history = dict(state['alert_history'])
+        
+        allowlist = state.get('allowlist')
+        if self.allowlist_watcher is not None and allowlist and self.allowlist_watcher.restore(allowlist):
+            try:
+                result = self.allowlist_watcher.check()
+            except Exception as e:
+                print(f"Error checking authorized devices against the checkpoint: {e}")
+            else:
+                index = self.allowlist_watcher.index
+                if result is None:
+                    print(f"Resumed {len(index)} authorized devices from checkpoint")
+                else:
+                    print(f"Authorized device list changed since the checkpoint: {len(index)} entries "
+                          f"({'full' if result[1] else 'incremental'} reload)")
+                    ALLOWLIST_RELOAD_DURATION.observe(self.allowlist_watcher.last_reload_seconds,
+                                                      kind='full' if result[1] else 'incremental')
+                self.authorized_index = index
+                ALLOWLIST_ENTRIES.set(len(index))
+        
+        print(f"Resumed {len(self.alert_history)} reported alerts from {self.checkpoint.path}")
+        return True
+    
+    def checkpoint_state(self):
+        """Monitor state to save in a checkpoint"""
+        return {
+            'alert_history': self.alert_history,
+            'allowlist': self.allowlist_watcher.state() if self.allowlist_watcher is not None else None
+        }
+    
+    def save_checkpoint(self, force=False):
+        """Write a checkpoint if one is configured and due (or always with force)"""
+        if self.checkpoint is None or not (force or self.checkpoint.due()):
+            return False
+        try:
+            self.checkpoint.save(self.checkpoint_state())
+            return True
+        except Exception as e:
+            print(f"Error saving checkpoint: {e}")
+            return False
+    
+    def on_authorized_devices_reloaded(self, index, full_reload):
+        """Swap in a freshly reloaded allowlist index"""
+        previous = len(self.authorized_index)
+        # A single attribute assignment, so a scan in progress sees either the
+        # old index or the new one
+        self.authorized_index = index
+        self.policy_engine.set_allowlist(index)
+        if self.checkpoint is not None:
+            self.checkpoint.mark_dirty()
+        ALLOWLIST_ENTRIES.set(len(index))
+        ALLOWLIST_RELOAD_DURATION.observe(self.allowlist_watcher.last_reload_seconds,
+                                          kind='full' if full_reload else 'incremental')
+        if full_reload:
+            print(f"Reloaded authorized devices: {len(index)} entries")
+        else:
+            print(f"Authorized devices updated: {len(index) - previous} new entries")
     
     def get_connected_usb_devices(self):
         """Get a list of currently connected USB devices"""
@@ -51,7 +217,7 @@ class USBAuthorizationSystem:
         if platform.system() == 'Windows':
             # Windows-specific USB detection using PowerShell
             ps_command = "Get-PnpDevice -PresentOnly | Where-Object { $_.InstanceId -match '^USB' } | Select-Object -Property FriendlyName, InstanceId, DeviceID | ConvertTo-Json"
-            process = subprocess.run(["powershell", "-Command", ps_command], capture_output=True, text=True)
+            process = run_command(["powershell", "-Command", ps_command])
             
             if process.returncode == 0 and process.stdout.strip():
                 import json
@@ -76,9 +242,17 @@ class USBAuthorizationSystem:
                             vendor_id = vid_match.group(1).lower()
                             product_id = pid_match.group(1).lower()
                             
+                            # Same serial extraction as register_usb, so serial-bound
+                            # entries in the authorized list can match
+                            serial_number = "Unknown"
+                            sn_match = re.search(r'\\(.+)$', instance_id)
+                            if sn_match:
+                                serial_number = sn_match.group(1)
+                            
                             connected_devices.append({
                                 'vendor_id': vendor_id,
                                 'product_id': product_id,
+                                'serial_number': serial_number,
                                 'device_name': friendly_name,
                                 'device_id': device_id,
                                 'instance_id': instance_id
@@ -87,34 +261,22 @@ class USBAuthorizationSystem:
                     print("Error parsing PowerShell output")
         
         elif platform.system() == 'Linux':
-            # Linux-specific USB detection using lsusb
-            process = subprocess.run(['lsusb'], capture_output=True, text=True)
+            # Read sysfs directly when it is available; no subprocess needed
+            sysfs_devices = enumerate_usb_devices(self.sysfs_root)
+            self.using_sysfs = sysfs_devices is not None
+            if sysfs_devices is not None:
+                return sysfs_devices
+            
+            # Fall back to lsusb
+            process = run_command(['lsusb'])
             
             if process.returncode == 0:
-                lines = process.stdout.strip().split('\n')
-                
-                for line in lines:
-                    # Example line: Bus 001 Device 002: ID 8087:0024 Intel Corp. Integrated Rate Matching Hub
-                    match = re.search(r'ID (\w+):(\w+)', line)
-                    if match:
-                        vendor_id = match.group(1).lower()
-                        product_id = match.group(2).lower()
-                        
-                        # Extract device name if present
-                        device_name = line.split(f"ID {vendor_id}:{product_id}")[-1].strip()
-                        if not device_name:
-                            device_name = "Unknown USB Device"
-                        
-                        connected_devices.append({
-                            'vendor_id': vendor_id,
-                            'product_id': product_id,
-                            'device_name': device_name,
-                            'device_id': f"{vendor_id}:{product_id}"
-                        })
+                self.last_lsusb_output = process.stdout
+                connected_devices = parse_lsusb_output(process.stdout)
         
         elif platform.system() == 'Darwin':  # macOS
             # macOS-specific USB detection using system_profiler
-            process = subprocess.run(['system_profiler', 'SPUSBDataType'], capture_output=True, text=True)
+            process = run_command(['system_profiler', 'SPUSBDataType'])
             
             if process.returncode == 0:
                 output = process.stdout
@@ -146,141 +308,498 @@ class USBAuthorizationSystem:
         return connected_devices
     
     def is_device_authorized(self, device):
-        """Check if a device is in the authorized list"""
-        for auth_device in self.authorized_devices:
-            if (device['vendor_id'] == auth_device['vendor_id'].lower() and 
-                device['product_id'] == auth_device['product_id'].lower()):
-                return True
-        return False
+        """Check a device against the policy and the authorized list"""
+        return self.policy_engine.is_authorized(device)
+    
+    def build_alert_message(self, detections, host, suppressed=0):
+        """Build one email alert listing unauthorized USB devices (see usb_alerts.build_alert_message)"""
+        from usb_alerts import build_alert_message
+        return build_alert_message(self.email_config, detections, host, suppressed)
     
     def send_email_alert(self, unauthorized_device):
-        """Send an email alert about unauthorized USB device"""
+        """Queue an unauthorized USB device for the next digest email alert"""
         try:
-            # Create message
-            msg = MIMEMultipart()
-            msg['From'] = self.email_config['sender_email']
-            msg['To'] = self.email_config['recipient_email']
-            msg['Subject'] = 'SECURITY ALERT: Unauthorized USB Device Detected'
-            
-            # Create message body
-            body = f"""
-            <html>
-              <body>
-                <h2>⚠️ Security Alert: Unauthorized USB Device Detected</h2>
-                <p>An unauthorized USB device has been connected to your system.</p>
-                <h3>Device Details:</h3>
-                <ul>
-                  <li><strong>Vendor ID:</strong> {unauthorized_device['vendor_id']}</li>
-                  <li><strong>Product ID:</strong> {unauthorized_device['product_id']}</li>
-                  <li><strong>Device Name:</strong> {unauthorized_device['device_name']}</li>
-                  <li><strong>Detection Time:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</li>
-                  <li><strong>System:</strong> {platform.node()}</li>
-                </ul>
-                <p>Please investigate this security incident immediately.</p>
-                <p><i>This is an automated message from your USB Authorization System.</i></p>
-              </body>
-            </html>
-            """
-            
-            msg.attach(MIMEText(body, 'html'))
-            
-            # Connect to SMTP server
-            server = smtplib.SMTP(self.email_config['smtp_server'], self.email_config['smtp_port'])
-            server.starttls()
-            server.login(self.email_config['sender_email'], self.email_config['sender_password'])
-            
-            # Send email
-            server.send_message(msg)
-            server.quit()
-            
-            print(f"Email alert sent for unauthorized device: {unauthorized_device['device_name']}")
+            self.alert_coalescer.submit(unauthorized_device, platform.node())
+            print(f"Email alert queued for unauthorized device: {unauthorized_device['device_name']}")
             return True
         except Exception as e:
-            print(f"Error sending email alert: {e}")
+            print(f"Error queueing email alert: {e}")
             return False
     
     def log_unauthorized_device(self, device):
-        """Log unauthorized device to a file"""
+        """Log unauthorized device to the audit log"""
         try:
-            with open('unauthorized_usb_log.csv', 'a', newline='') as f:
-                # Create header if file is empty
-                if os.path.getsize('unauthorized_usb_log.csv') == 0:
-                    fieldnames = ['timestamp', 'vendor_id', 'product_id', 'device_name', 'system', 'user']
-                    writer = csv.DictWriter(f, fieldnames=fieldnames)
-                    writer.writeheader()
-                else:
-                    writer = csv.DictWriter(f, fieldnames=['timestamp', 'vendor_id', 'product_id', 'device_name', 'system', 'user'])
-                
-                writer.writerow({
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'vendor_id': device['vendor_id'],
-                    'product_id': device['product_id'],
-                    'device_name': device['device_name'],
-                    'system': platform.node(),
-                    'user': os.getlogin()
-                })
+            self.audit_log.write(device)
             print(f"Logged unauthorized device: {device['device_name']}")
             return True
         except Exception as e:
             print(f"Error logging unauthorized device: {e}")
             return False
     
-    def monitor_usb_devices(self, check_interval=5):
-        """Monitor for USB devices at specified interval"""
-        print(f"Starting USB monitoring (check interval: {check_interval} seconds)")
+    def handle_arrival(self, device, identity=None):
+        """Check a newly attached device (identity: its device tracker key) and raise alerts"""
+        device_key = f"{device['vendor_id']}:{device['product_id']}"
+        
+        is_authorized, reason = self.policy_engine.evaluate(device)
+        verdict = 'authorized' if is_authorized else 'unauthorized'
+        DECISIONS.inc(verdict=verdict)
+        if identity is None:
+            identity = device_identity(device)
+        if self.event_stream is not None:
+            self.event_stream.device_event('arrival', device)
+            self.event_stream.device_event('verdict', device, verdict=verdict, reason=reason,
+                                           repeat=not is_authorized and identity in self.alert_history)
+        if self.fleet_agent is not None:
+            self.fleet_agent.submit({
+                'verdict': verdict,
+                'reason': reason,
+                'device': {
+                    'vendor_id': device['vendor_id'],
+                    'product_id': device['product_id'],
+                    'serial_number': device.get('serial_number', 'Unknown'),
+                    'device_name': device['device_name'],
+                    'location': device_location(device)
+                }
+            })
+        if is_authorized:
+            print(f"✓ AUTHORIZED: USB device detected: {device['device_name']} ({device_key}): {reason}")
+        else:
+            reported_at = self.alert_history.get(identity)
+            if reported_at is not None:
+                # Still attached from before a restart and already alerted on
+                print(f"⚠️ Unauthorized USB device still attached: {device['device_name']} ({device_key}), "
+                      f"reported at {reported_at}")
+                return
+            print(f"⚠️ ALERT: Unauthorized USB device detected: {device['device_name']} ({device_key}): {reason}")
+            self.alert_history[identity] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            # Log the unauthorized device
+            self.log_unauthorized_device(device)
+            # Send email alert, unless the fleet collector sends it
+            if self.fleet_agent is None and self.email_alerts:
+                self.send_email_alert(device)
+    
+    def handle_departure(self, device):
+        """Report a device that has been unplugged"""
+        if self.event_stream is not None:
+            self.event_stream.device_event('departure', device)
+        print(f"USB device removed: {device['device_name']} ({device['vendor_id']}:{device['product_id']})")
+    
+    def process_changes(self, arrived, departed):
+        """Handle the devices that arrived or departed since the previous snapshot"""
+        DEVICE_CHANGES.inc(len(arrived), change='arrived')
+        DEVICE_CHANGES.inc(len(departed), change='departed')
+        if self.checkpoint is not None and (arrived or departed):
+            self.checkpoint.mark_dirty()
+        if self.trace_recorder is not None:
+            source = self.enumeration_source()
+            self.trace_recorder.record(list(self.device_tracker.devices.values()), source,
+                                       self.last_lsusb_output if source == 'lsusb' else None)
+        for device in departed:
+            self.handle_departure(device)
+        # Forget the alerts of devices that are gone, including ones unplugged
+        # while the monitor was down, so plugging one back in alerts again
+        for identity in self.alert_history.keys() - self.device_tracker.devices.keys():
+            del self.alert_history[identity]
+        if arrived:
+            identities = {id(device): identity for identity, device in self.device_tracker.devices.items()}
+            for device in arrived:
+                self.handle_arrival(device, identities.get(id(device)))
+    
+    def enumeration_source(self):
+        """Name of the mechanism the last scan used to list devices"""
+        if self.using_sysfs:
+            return 'sysfs'
+        return ENUMERATION_TOOLS.get(platform.system(), 'none')
+    
+    def scan_devices(self):
+        """Full scan, diffed against the previous snapshot"""
+        with SCAN_DURATION.time():
+            start = time.perf_counter()
+            connected_devices = self.get_connected_usb_devices()
+            ENUMERATION_DURATION.observe(time.perf_counter() - start, source=self.enumeration_source())
+            
+            arrived, departed = self.device_tracker.update(connected_devices)
+            self.process_changes(arrived, departed)
+        DEVICES_ATTACHED.set(len(self.device_tracker))
+        return bool(arrived or departed)
+    
+    def handle_events(self, events):
+        """React to a batch of hotplug events, rescanning fully when they cannot be applied"""
+        from usb_hotplug import describe_event
+        for event in events:
+            print(f"USB event: {describe_event(event)}")
+            HOTPLUG_EVENTS.inc(action=event['action'])
+        
+        if not events or not self.apply_hotplug_events(events):
+            self.scan_devices()
+        DEVICES_ATTACHED.set(len(self.device_tracker))
+    
+    def run_tick(self, function, *args):
+        """Run one monitor tick, under the profiler when one was requested"""
+        if self.tick_profiler is not None:
+            return self.tick_profiler.run(function, *args)
+        return function(*args)
+    
+    def apply_hotplug_events(self, events):
+        """Apply hotplug events from the affected sysfs entries; returns False when a full scan is needed"""
+        if not self.using_sysfs:
+            return False
+        
+        for event in events:
+            port_path = os.path.basename(event.get('devpath', ''))
+            if event['action'] not in ('add', 'remove') or not port_path:
+                return False
+            
+            if event['action'] == 'add':
+                device = read_sysfs_device(os.path.join(self.sysfs_root, port_path))
+                if device is None:
+                    # Already unplugged again, or not a USB device
+                    continue
+                arrived, departed = self.device_tracker.add(device)
+            else:
+                device = self.device_tracker.remove_port(port_path)
+                arrived, departed = [], [device] if device is not None else []
+            self.process_changes(arrived, departed)
+        
+        return True
+    
+    def check_devices(self, send_email=False, email_timeout=30):
+        """Scan once and report every device's verdict; nothing is logged, and emailed only if send_email"""
+        devices = self.get_connected_usb_devices()
+        host = platform.node()
+        checked_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        report = {
+            'host': host,
+            'timestamp': checked_at,
+            'source': self.enumeration_source(),
+            'devices': [],
+            'unauthorized': 0
+        }
+        unauthorized = []
+        for device in devices:
+            is_authorized, reason = self.policy_engine.evaluate(device)
+            DECISIONS.inc(verdict='authorized' if is_authorized else 'unauthorized')
+            if not is_authorized:
+                unauthorized.append((device, checked_at))
+            report['devices'].append({
+                'vendor_id': device['vendor_id'],
+                'product_id': device['product_id'],
+                'serial_number': device.get('serial_number', 'Unknown'),
+                'device_name': device.get('device_name', 'Unknown USB Device'),
+                'location': device_location(device),
+                'authorized': is_authorized,
+                'reason': reason
+            })
+        report['unauthorized'] = len(unauthorized)
+        
+        if send_email and unauthorized:
+            from usb_alerts import AlertDispatcher
+            # A spool of its own, so alerts a running monitor has pending are neither
+            # sent twice nor waited for; what is not delivered in time is handed over
+            dispatcher = AlertDispatcher(self.email_config,
+                                         spool_dir=os.path.join(self.alert_dispatcher.spool_dir,
+                                                                f"check-{os.getpid()}"))
+            dispatcher.start()
+            try:
+                dispatcher.submit(self.build_alert_message(unauthorized, host))
+                dispatcher.drain(email_timeout)
+            finally:
+                dispatcher.stop()
+                dispatcher.hand_over(self.alert_dispatcher.spool_dir)
+            if dispatcher.sent_count:
+                report['email'] = 'sent'
+            elif dispatcher.dead_count:
+                report['email'] = 'rejected'
+            else:
+                report['email'] = 'spooled'
+        return report
+    
+    def monitor_usb_devices(self, check_interval=None, event_source=None, hotplug=True, scheduler=None):
+        """Monitor for USB devices using hotplug events (see usb_hotplug), or by polling on scheduler"""
+        from usb_hotplug import create_hotplug_source
+        from usb_scheduler import AdaptivePollScheduler
+        
+        if event_source is None and hotplug:
+            event_source = create_hotplug_source()
+        
+        if scheduler is None:
+            if check_interval is not None:
+                scheduler = AdaptivePollScheduler.fixed(check_interval)
+            else:
+                scheduler = AdaptivePollScheduler()
+        
+        if event_source is not None:
+            print("Starting USB monitoring (hotplug events)")
+        else:
+            print(f"Starting USB monitoring ({scheduler.describe()})")
         print(f"System: {platform.system()} {platform.release()}")
         print("Press Ctrl+C to stop monitoring")
         
-        # Track detected devices to avoid duplicate alerts
-        detected_devices = set()
+        # Pick up changes to the authorized list without restarting
+        if self.allowlist_watcher is not None:
+            self.allowlist_watcher.start(self.on_authorized_devices_reloaded)
+        self.audit_log.start()
+        if self.fleet_agent is not None:
+            self.fleet_agent.start()
+        if self.event_stream is not None:
+            self.alert_dispatcher.on_result = self.event_stream.alert_result
+            self.event_stream.start()
+        # Deliver email alerts in the background so a slow mail server never delays a scan
+        if self.email_alerts:
+            self.alert_dispatcher.start()
         
         try:
+            # Initial scan picks up everything that was plugged in before we started
+            scheduler.run(self.scan_devices)
+            
+            # With a profiler or checkpoint, wake up regularly so a requested
+            # profile or a due checkpoint does not wait for the next hotplug event
+            wake_interval = 1.0 if self.tick_profiler is not None or self.checkpoint is not None else None
+            
             while True:
-                connected_devices = self.get_connected_usb_devices()
-                
-                for device in connected_devices:
-                    device_key = f"{device['vendor_id']}:{device['product_id']}"
+                if event_source is not None:
+                    try:
+                        events = event_source.wait_for_events(timeout=wake_interval)
+                    except OSError as e:
+                        print(f"Hotplug event source failed ({e}), falling back to polling")
+                        event_source.close()
+                        event_source = None
+                        continue
                     
-                    # Only process new devices that haven't been detected before
-                    if device_key not in detected_devices:
-                        # Check if device is authorized
-                        is_authorized = self.is_device_authorized(device)
-                        
-                        if is_authorized:
-                            print(f"✓ AUTHORIZED: USB device detected: {device['device_name']} ({device_key})")
-                        else:
-                            print(f"⚠️ ALERT: Unauthorized USB device detected: {device['device_name']} ({device_key})")
-                            # Log the unauthorized device
-                            self.log_unauthorized_device(device)
-                            # Send email alert
-                            self.send_email_alert(device)
-                        
-                        # Add to detected set to avoid duplicate alerts
-                        detected_devices.add(device_key)
-                
-                time.sleep(check_interval)
+                    if events is None:
+                        print("Event source finished")
+                        break
+                    if events or (self.tick_profiler and self.tick_profiler.requested):
+                        self.run_tick(self.handle_events, events)
+                else:
+                    scheduler.wait()
+                    scheduler.run(lambda: self.run_tick(self.scan_devices))
+                self.save_checkpoint()
                 
         except KeyboardInterrupt:
             print("\nUSB monitoring stopped by user")
         except Exception as e:
             print(f"Error in USB monitoring: {e}")
+        finally:
+            if self.allowlist_watcher is not None:
+                self.allowlist_watcher.stop()
+            self.save_checkpoint(force=True)
+            # Pending digests go to the spool so they are sent on the next start
+            self.alert_coalescer.close()
+            self.alert_dispatcher.stop()
+            self.audit_log.close()
+            self.suppression_log.close()
+            if self.fleet_agent is not None:
+                self.fleet_agent.stop()
+            if self.event_stream is not None:
+                self.event_stream.close()
+            if event_source is not None:
+                event_source.close()
 
-def main():
-    # Check for arguments
-    if len(sys.argv) < 2:
-        print("Usage: python usb_authorization.py <authorized_usb_csv>")
-        sys.exit(1)
+def check_main(argv):
+    """One-shot check: JSON report on stdout; exits 0 when clean, 1 on unauthorized devices, 2 on errors"""
+    parser = argparse.ArgumentParser(prog=f"{os.path.basename(sys.argv[0])} check",
+                                     description="Scan once and report unauthorized USB devices as JSON")
+    parser.add_argument('authorized_usb_csv', help="CSV file of authorized USB devices, or a SQLite database")
+    parser.add_argument('--policy', help="JSON policy file with allow/deny rules (see usb_policy.py)")
+    parser.add_argument('--email', action='store_true', help="email an alert if unauthorized devices are found")
+    parser.add_argument('--email-timeout', type=float, default=30.0,
+                        help="how long to wait for the alert to be delivered (seconds)")
+    args = parser.parse_args(argv)
+    
+    # Progress messages go to stderr so stdout carries only the JSON report
+    with redirect_stdout(sys.stderr):
+        try:
+            if not os.path.isfile(args.authorized_usb_csv):
+                raise FileNotFoundError(f"authorized USB file '{args.authorized_usb_csv}' not found")
+            policy = load_policy(args.policy) if args.policy else None
+            usb_system = USBAuthorizationSystem(args.authorized_usb_csv, policy=policy)
+            report = usb_system.check_devices(send_email=args.email, email_timeout=args.email_timeout)
+            exit_code = 1 if report['unauthorized'] else 0
+        except Exception as e:
+            report = {'error': str(e)}
+            exit_code = 2
+    
+    print(json.dumps(report, indent=2))
+    return exit_code
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['check']:
+        sys.exit(check_main(argv[1:]))
+    if argv[:1] == ['monitor']:
+        argv = argv[1:]
+    from usb_audit_log import DEFAULT_LOG_FILE, FSYNC_POLICIES
+    from usb_checkpoint import DEFAULT_CHECKPOINT_FILE
+    
+    parser = argparse.ArgumentParser(
+        description="Monitor USB devices against an authorized list. "
+                    "Run with 'check' as the first argument for a one-shot JSON check.")
+    parser.add_argument('authorized_usb_csv',
+                        help="CSV file of authorized USB devices, or a SQLite database made with "
+                             "'usb_allowlist.py convert'")
+    parser.add_argument('--policy', help="JSON policy file with allow/deny rules (see usb_policy.py)")
+    parser.add_argument('--log-file',
+                        help=f"unauthorized device log (.csv, or .jsonl for JSON Lines; default: "
+                             f"{DEFAULT_LOG_FILE}, or a separate file for --replay-trace)")
+    parser.add_argument('--log-format', choices=['csv', 'jsonl'],
+                        help="log format (default: from the log file extension)")
+    parser.add_argument('--log-fsync', choices=FSYNC_POLICIES, default='flush',
+                        help="fsync after every row, after every batch, or never")
+    parser.add_argument('--log-max-bytes', type=int, default=0,
+                        help="rotate the log once it reaches this size")
+    parser.add_argument('--log-rotate-daily', action='store_true', help="rotate the log every day")
+    parser.add_argument('--log-compress', action='store_true', help="gzip rotated log segments")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_FILE,
+                        help="state file used to resume after a restart without re-alerting")
+    parser.add_argument('--checkpoint-interval', type=float, default=30.0,
+                        help="save the checkpoint at most this often while devices change (seconds)")
+    parser.add_argument('--no-checkpoint', action='store_true', help="do not save or resume state")
+    parser.add_argument('--no-hotplug', action='store_true',
+                        help="poll for devices even when kernel hotplug events are available")
+    parser.add_argument('--poll-min', type=float, default=1.0,
+                        help="polling interval right after a device change (seconds)")
+    parser.add_argument('--poll-max', type=float, default=30.0,
+                        help="longest polling interval while nothing changes (seconds)")
+    parser.add_argument('--poll-cpu-budget', type=float, default=0.01,
+                        help="largest fraction of one CPU a poll may use (0 disables)")
+    parser.add_argument('--collector',
+                        help="report events to a fleet collector at host:port or unix:/path (see usb_fleet.py); "
+                             "alert emails are then sent by the collector")
+    parser.add_argument('--collector-spool', default='fleet_spool',
+                        help="where events wait while the collector is unreachable")
+    parser.add_argument('--events', metavar='SINK',
+                        help="stream arrival, departure, verdict and alert events as JSON Lines to stdout, "
+                             "file:/path or unix:/path (see usb_events.py); with stdout, messages go to stderr")
+    parser.add_argument('--events-buffer', type=int, default=10000,
+                        help="events held for a slow consumer before new ones are dropped")
+    parser.add_argument('--record-trace', help="record every change in the attached devices to this trace file")
+    parser.add_argument('--replay-trace',
+                        help="replay a trace file (see usb_replay.py) instead of watching real devices")
+    parser.add_argument('--replay-speed', type=float, default=1.0,
+                        help="replay speed multiplier; 0 replays as fast as possible")
+    parser.add_argument('--replay-email', action='store_true',
+                        help="send alert emails for unauthorized devices seen during a replay")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--metrics-socket', help="serve Prometheus metrics on this Unix socket")
+    parser.add_argument('--profile-signal', action='store_true',
+                        help="profile the next monitor tick whenever SIGUSR1 is received")
+    args = parser.parse_args(argv)
+    
+    # Events on stdout need stdout to themselves, so messages go to stderr instead
+    event_output = sys.stdout
+    with redirect_stdout(sys.stderr if args.events in ('stdout', '-') else sys.stdout):
+        run_monitor(args, event_output)
 
-    authorized_usb_csv = sys.argv[1]
+def run_monitor(args, event_output):
+    """Set up the monitor from parsed command line arguments and run it until stopped"""
+    from usb_audit_log import DEFAULT_LOG_FILE, AuditLogWriter
+    from usb_checkpoint import MonitorCheckpoint
+    from usb_scheduler import AdaptivePollScheduler
+    
+    authorized_usb_csv = args.authorized_usb_csv
     
     # Check if the CSV file exists
     if not os.path.isfile(authorized_usb_csv):
         print(f"Error: Authorized USB CSV file '{authorized_usb_csv}' not found.")
         sys.exit(1)
     
+    policy = None
+    if args.policy:
+        try:
+            policy = load_policy(args.policy)
+        except (OSError, ValueError) as e:
+            print(f"Error: cannot read policy file '{args.policy}': {e}")
+            sys.exit(1)
+    
+    log_file = args.log_file
+    if log_file is None:
+        log_file = DEFAULT_LOG_FILE
+        if args.replay_trace:
+            # A replay must not mix its findings into the real log
+            from usb_replay import DEFAULT_REPLAY_LOG_FILE
+            log_file = DEFAULT_REPLAY_LOG_FILE
+    audit_log = AuditLogWriter(log_file, log_format=args.log_format, fsync=args.log_fsync,
+                               max_bytes=args.log_max_bytes, rotate_daily=args.log_rotate_daily,
+                               compress=args.log_compress)
+    
     # Initialize and run the USB authorization system
-    usb_system = USBAuthorizationSystem(authorized_usb_csv)
-    usb_system.monitor_usb_devices()
+    checkpoint = None
+    # A replay must not resume from or overwrite the real monitor's state
+    if not args.no_checkpoint and not args.replay_trace:
+        checkpoint = MonitorCheckpoint(args.checkpoint, interval=args.checkpoint_interval)
+    try:
+        usb_system = USBAuthorizationSystem(authorized_usb_csv, audit_log=audit_log, checkpoint=checkpoint,
+                                            policy=policy)
+    except ValueError as e:
+        print(f"Error: invalid policy file '{args.policy}': {e}")
+        sys.exit(1)
+    
+    if args.collector:
+        from usb_fleet import FleetAgent
+        try:
+            usb_system.fleet_agent = FleetAgent(args.collector, spool_dir=args.collector_spool)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Reporting events to fleet collector {args.collector}")
+    
+    if args.events:
+        from usb_events import EventStream
+        try:
+            usb_system.event_stream = EventStream.from_spec(args.events, stdout=event_output,
+                                                            max_buffer=args.events_buffer)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Streaming events to {usb_system.event_stream.sink.name}")
+    
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+        print(f"Metrics available at http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.metrics_socket:
+        start_metrics_socket(args.metrics_socket)
+        print(f"Metrics available on Unix socket {args.metrics_socket}")
+    if args.profile_signal:
+        usb_system.tick_profiler = TickProfiler()
+        if usb_system.tick_profiler.install():
+            print(f"Send SIGUSR1 to process {os.getpid()} to profile one monitor tick")
+        else:
+            print("Tick profiling needs SIGUSR1, which this platform does not support")
+            usb_system.tick_profiler = None
+    
+    event_source = None
+    if args.replay_trace:
+        from usb_replay import ReplayEventSource
+        event_source = ReplayEventSource.from_file(args.replay_trace, speed=args.replay_speed)
+        event_source.attach(usb_system)
+        usb_system.email_alerts = args.replay_email
+        print(f"Replaying {args.replay_trace} at {args.replay_speed:g}x speed, logging to {log_file}"
+              f"{'' if args.replay_email else ', without alert emails'}")
+    
+    recorder = None
+    if args.record_trace:
+        from usb_replay import TraceRecorder
+        recorder = TraceRecorder(args.record_trace)
+        recorder.attach(usb_system)
+        print(f"Recording device changes to {args.record_trace}")
+    
+    scheduler = AdaptivePollScheduler(min_interval=args.poll_min, max_interval=max(args.poll_min, args.poll_max),
+                                      cpu_budget=args.poll_cpu_budget)
+    start = time.monotonic()
+    try:
+        usb_system.monitor_usb_devices(event_source=event_source, hotplug=not args.no_hotplug, scheduler=scheduler)
+    finally:
+        if recorder is not None:
+            recorder.close()
+            print(f"Recorded {recorder.records} trace records")
+        if event_source is not None:
+            print(f"Replayed {event_source.replayed} trace records in {time.monotonic() - start:.2f} seconds")
+        if usb_system.event_stream is not None:
+            stream = usb_system.event_stream
+            print(f"Event stream: {stream.written} events written, {stream.dropped} dropped")
 
 if __name__ == "__main__":
     main()
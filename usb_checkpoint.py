@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+import marshal
+import os
+import sys
+import tempfile
+import time
+
+DEFAULT_CHECKPOINT_FILE = 'usb_monitor_state.ckpt'
+CHECKPOINT_MAGIC = 'usb-monitor-checkpoint'
+# Bump when the layout of the saved state changes
+CHECKPOINT_VERSION = 3
+
+
+def checkpoint_header():
+    """Header identifying files this interpreter can read back
+
+    marshal's format is only guaranteed within one Python version, so a
+    checkpoint written by another version is ignored instead of trusted.
+    """
+    return (CHECKPOINT_MAGIC, CHECKPOINT_VERSION, marshal.version, tuple(sys.version_info[:2]))
+
+
+class MonitorCheckpoint:
+    """Compact state file that lets the monitor resume after a restart
+
+    The state is a dictionary of plain values (see
+    USBAuthorizationSystem.checkpoint_state) written with marshal behind a
+    version header. Saves go to a temporary file that is renamed over the
+    old checkpoint, so a crash never leaves a half-written file behind.
+
+    Saves only happen when something changed (mark_dirty) and at most once
+    per interval seconds, plus a final one on shutdown.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_FILE, interval=30.0, clock=time.monotonic):
+        self.path = path
+        self.interval = interval
+        self.clock = clock
+        self.dirty = False
+        self.last_save = clock()
+        self.saves = 0
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def due(self):
+        """True when there are unsaved changes and the interval has passed"""
+        return self.dirty and self.clock() - self.last_save >= self.interval
+
+    def load(self):
+        """Return the saved state, or None when there is no usable checkpoint"""
+        try:
+            with open(self.path, 'rb') as f:
+                if marshal.load(f) != checkpoint_header():
+                    print(f"Ignoring checkpoint {self.path}: written by another version")
+                    return None
+                state = marshal.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            print(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+        return state if isinstance(state, dict) else None
+
+    def save(self, state):
+        """Atomically replace the checkpoint file with state"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.usb_checkpoint_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(checkpoint_header(), f)
+                marshal.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self.dirty = False
+        self.last_save = self.clock()
+        self.saves += 1
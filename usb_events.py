@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+import json
+import platform
+import queue
+import socket
+import sys
+import threading
+from datetime import datetime
+
+from usb_metrics import STREAM_EVENTS_DROPPED, STREAM_EVENTS_WRITTEN
+from usb_snapshot import device_location
+
+# Bumped whenever a field is renamed or removed; new fields may appear at any time
+EVENT_SCHEMA_VERSION = 1
+EVENT_TYPES = ('arrival', 'departure', 'verdict', 'alert')
+# Largest number of events written in one go
+WRITE_BATCH = 512
+
+
+def device_fields(device):
+    """The device fields every event carries, always present and always strings (or a list)"""
+    return {
+        'vendor_id': device.get('vendor_id', ''),
+        'product_id': device.get('product_id', ''),
+        'serial_number': device.get('serial_number') or '',
+        'device_name': device.get('device_name', ''),
+        'location': device_location(device),
+        'device_class': device.get('device_class', ''),
+        'interface_classes': list(device.get('interface_classes') or ())
+    }
+
+
+class StreamSink:
+    """Writes event lines to an already open text stream, such as stdout"""
+
+    def __init__(self, stream, name='stdout'):
+        self.stream = stream
+        self.name = name
+
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    """Appends event lines to a file, opened on first write"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = f"file:{path}"
+        self.file = None
+
+    def write(self, data):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class UnixSocketSink:
+    """Sends event lines to a consumer listening on a Unix stream socket
+
+    The connection is made on first write and again after it breaks.
+    """
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.name = f"unix:{path}"
+        self.timeout = timeout
+        self.sock = None
+
+    def write(self, data):
+        if self.sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self.sock = sock
+        try:
+            self.sock.sendall(data.encode('utf-8'))
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def open_sink(spec, stdout=None):
+    """Sink for 'stdout', 'file:/path' or 'unix:/path'"""
+    if spec in ('stdout', '-'):
+        return StreamSink(stdout or sys.stdout)
+    if spec.startswith('file:') and spec[len('file:'):]:
+        return FileSink(spec[len('file:'):])
+    if spec.startswith('unix:') and spec[len('unix:'):]:
+        return UnixSocketSink(spec[len('unix:'):])
+    raise ValueError(f"event stream must be stdout, file:/path or unix:/path, not '{spec}'")
+
+
+class EventStream:
+    """Publishes monitor events as JSON Lines for SIEM shippers and other consumers
+
+    Every line is one JSON object with the fields
+
+        v       schema version (EVENT_SCHEMA_VERSION)
+        seq     sequence number, counting from 1 for each run
+        time    ISO 8601 time with milliseconds
+        host    host name
+        event   'arrival', 'departure', 'verdict' or 'alert'
+
+    followed by the event's own fields: arrival, departure and verdict
+    events carry a 'device' object (see device_fields); verdicts add
+    'verdict' ('authorized' or 'unauthorized'), 'reason' and 'repeat' (true
+    when the device was already reported before a restart); alert events
+    carry 'status' ('queued', 'delivered', 'failed' or 'discarded'),
+    'alert_id', 'subject' and 'error'.
+
+    emit() only puts the event in a bounded buffer; a background thread
+    serializes and writes it. When the consumer falls behind and the buffer
+    is full, or a write fails, events are dropped and counted rather than
+    ever blocking the caller. Dropped events leave gaps in seq, so a
+    consumer can tell how many it missed.
+    """
+
+    def __init__(self, sink, max_buffer=10000, host=None, retry_interval=1.0):
+        self.sink = sink
+        self.host = host or platform.node()
+        self.retry_interval = retry_interval
+        self.queue = queue.Queue(maxsize=max_buffer)
+        self.seq = 0
+        self.written = 0
+        self.dropped = 0
+        self.failing = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_spec(cls, spec, stdout=None, **kwargs):
+        return cls(open_sink(spec, stdout), **kwargs)
+
+    def _drop(self, count):
+        with self._lock:
+            self.dropped += count
+        STREAM_EVENTS_DROPPED.inc(count)
+
+    def emit(self, event_type, **fields):
+        """Queue one event without blocking; returns False when it had to be dropped"""
+        with self._lock:
+            self.seq += 1
+            event = {
+                'v': EVENT_SCHEMA_VERSION,
+                'seq': self.seq,
+                'time': datetime.now().astimezone().isoformat(timespec='milliseconds'),
+                'host': self.host,
+                'event': event_type
+            }
+        event.update(fields)
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self._drop(1)
+            return False
+
+    def device_event(self, event_type, device, **fields):
+        """Emit an arrival, departure or verdict event for one device"""
+        return self.emit(event_type, device=device_fields(device), **fields)
+
+    def alert_result(self, status, alert_id, subject, error=None):
+        """Emit an alert event; matches the AlertDispatcher.on_result callback"""
+        return self.emit('alert', status=status, alert_id=alert_id, subject=subject or '',
+                         error=str(error) if error is not None else None)
+
+    def _next_batch(self):
+        try:
+            events = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        while len(events) < WRITE_BATCH:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _write(self, events):
+        """Write one batch; returns False (after counting it as dropped) when the sink failed"""
+        try:
+            self.sink.write(''.join(json.dumps(event) + '\n' for event in events))
+        except (OSError, ValueError) as e:
+            if not self.failing:
+                print(f"Event stream {self.sink.name} unavailable ({e}); dropping events")
+                self.failing = True
+            self._drop(len(events))
+            return False
+        if self.failing:
+            print(f"Event stream {self.sink.name} available again after {self.dropped} dropped events")
+            self.failing = False
+        self.written += len(events)
+        STREAM_EVENTS_WRITTEN.inc(len(events))
+        return True
+
+    def _run(self):
+        while True:
+            events = self._next_batch()
+            if not events:
+                if self._stop.is_set():
+                    break
+                continue
+            if not self._write(events) and not self._stop.is_set():
+                # Give the consumer a moment before reconnecting; what arrives
+                # meanwhile waits in the buffer or is dropped when it is full
+                self._stop.wait(self.retry_interval)
+        self.sink.close()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='event-stream', daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=5):
+        """Write what is buffered and stop; gives up on a stuck consumer after timeout seconds"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
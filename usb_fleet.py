@@ -0,0 +1,535 @@
+#!/usr/bin/python3
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import queue
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from usb_alerts import DEFAULT_SUPPRESSION_LOG, AlertCoalescer, AlertDispatcher, build_alert_message
+from usb_audit_log import DEFAULT_LOG_FILE, AuditLogWriter, current_user
+from usb_log_query import build_index
+
+DEFAULT_AGENT_SPOOL_DIR = 'fleet_spool'
+DEFAULT_COLLECTOR_SPOOL_DIR = 'collector_alert_spool'
+# Longest line (one batch) the collector accepts
+MAX_LINE_BYTES = 4 * 1024 * 1024
+# File next to the collector's log that remembers recent event ids across restarts
+SEEN_IDS_SUFFIX = '.ids'
+# Log column holding the time the agent saw the device
+DETECTED_AT_FIELD = 'detected_at'
+
+
+def parse_address(address):
+    """Parse 'unix:/path', 'tcp:host:port' or 'host:port' into (family, address)"""
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    if address.startswith('tcp:'):
+        address = address[len('tcp:'):]
+    host, separator, port = address.rpartition(':')
+    if not separator or not port.isdigit():
+        raise ValueError(f"collector address must be unix:/path or host:port, not '{address}'")
+    return 'tcp', (host.strip('[]') or '127.0.0.1', int(port))
+
+
+def open_connection(address, timeout):
+    """Blocking stream socket connected to a collector address"""
+    family, target = parse_address(address)
+    if family == 'unix':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(target)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    return socket.create_connection(target, timeout=timeout)
+
+
+class FleetAgent:
+    """Sends a host's device events to a fleet collector
+
+    Events are batched (batch_size events, or whatever arrived within
+    flush_interval seconds) and written as one JSON line over a persistent
+    connection. The next batch is only sent once the collector acknowledged
+    the previous one, so a slow collector slows the agent down instead of
+    being flooded. Events that cannot be sent, because the collector is
+    unreachable or the in-memory queue is full, are written to spool_dir and
+    sent first after reconnecting.
+
+    Every event gets an id that is unique across restarts, so the collector
+    can drop the duplicates that retransmission after a broken connection
+    produces.
+    """
+
+    def __init__(self, address, spool_dir=DEFAULT_AGENT_SPOOL_DIR, host=None, batch_size=100,
+                 flush_interval=1.0, max_queue=1000, ack_timeout=10, initial_backoff=1, max_backoff=60):
+        parse_address(address)
+        self.address = address
+        self.spool_dir = spool_dir
+        self.host = host or platform.node()
+        self.user = current_user()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ack_timeout = ack_timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.boot_id = uuid.uuid4().hex[:12]
+        self.counter = itertools.count(1)
+        self.sequence = itertools.count(1)
+        self.sock = None
+        self.reader = None
+        self.sent_count = 0
+        self.spooled_count = 0
+        self._spool_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Spool handling
+
+    def _spool(self, events):
+        """Write events to a new spool file"""
+        if not events:
+            return
+        with self._spool_lock:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            name = f"{time.time():.6f}-{uuid.uuid4().hex}.ndjson"
+            temp_path = os.path.join(self.spool_dir, name + '.tmp')
+            with open(temp_path, 'w') as f:
+                for event in events:
+                    f.write(json.dumps(event) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, os.path.join(self.spool_dir, name))
+            self.spooled_count += len(events)
+
+    def _spool_files(self):
+        try:
+            return sorted(name for name in os.listdir(self.spool_dir) if name.endswith('.ndjson'))
+        except OSError:
+            return []
+
+    def _send_spooled(self):
+        """Send spooled events, oldest file first, removing each file once it is acknowledged"""
+        for name in self._spool_files():
+            path = os.path.join(self.spool_dir, name)
+            with open(path) as f:
+                events = [json.loads(line) for line in f if line.strip()]
+            for start in range(0, len(events), self.batch_size):
+                self._send(events[start:start + self.batch_size])
+            os.remove(path)
+
+    # Connection
+
+    def _connect(self):
+        self.sock = open_connection(self.address, self.ack_timeout)
+        self.sock.settimeout(self.ack_timeout)
+        self.reader = self.sock.makefile('rb')
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.reader.close()
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+            self.reader = None
+
+    def _send(self, events):
+        """Send one batch and wait for the collector to acknowledge it"""
+        sequence = next(self.sequence)
+        line = json.dumps({'type': 'batch', 'seq': sequence, 'events': events}) + '\n'
+        self.sock.sendall(line.encode('utf-8'))
+        reply = self.reader.readline()
+        if not reply:
+            raise ConnectionError("collector closed the connection")
+        ack = json.loads(reply)
+        if ack.get('type') != 'ack' or ack.get('seq') != sequence:
+            raise ConnectionError(f"unexpected reply from collector: {reply[:100]!r}")
+        self.sent_count += len(events)
+
+    def _next_batch(self):
+        """Collect up to batch_size events, waiting at most flush_interval for the first"""
+        try:
+            events = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(events) < self.batch_size:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _deliver(self, events):
+        """Send spooled events and then events; returns False (after spooling events) on failure"""
+        try:
+            if self.sock is None:
+                self._connect()
+            self._send_spooled()
+            if events:
+                self._send(events)
+            return True
+        except (OSError, ValueError) as e:
+            print(f"Fleet collector {self.address} unavailable ({e}); spooling events")
+            self._close()
+            self._spool(events)
+            return False
+
+    def _run(self):
+        backoff = self.initial_backoff
+        while not self._stop.is_set():
+            events = self._next_batch()
+            if not events and (self.sock is not None or not self._spool_files()):
+                continue
+            if self._deliver(events):
+                backoff = self.initial_backoff
+            elif self._stop.wait(backoff):
+                break
+            else:
+                backoff = min(backoff * 2, self.max_backoff)
+
+        # One last attempt for whatever is still queued; the spool keeps the rest
+        remaining = []
+        while True:
+            try:
+                remaining.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if remaining and self.sock is not None:
+            self._deliver(remaining)
+        else:
+            self._spool(remaining)
+        self._close()
+
+    # Public API
+
+    def submit(self, event):
+        """Queue one event for the collector without blocking; returns the event as sent"""
+        event = dict(event, id=f"{self.host}:{self.boot_id}:{next(self.counter)}",
+                     host=self.host, user=self.user)
+        event.setdefault('timestamp', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # The collector is not keeping up; keep the event on disk instead
+            self._spool([event])
+        return event
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='fleet-agent', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop sending; events that were not acknowledged stay in the spool"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+class FleetCollector:
+    """Receives device events from fleet agents (asyncio)
+
+    Each batch is processed and then acknowledged, which is what paces the
+    agents. Events seen before (by id) are dropped; with seen_ids_path the
+    last dedup_size ids are also kept on disk, so batches an agent resends
+    after a collector restart are not logged or emailed twice.
+
+    Unauthorized devices go to one audit log for the whole fleet, whose
+    sidecar time index (see usb_log_query) is refreshed every index_interval
+    seconds. Rows are stamped with the time the collector received them, so
+    the log stays in order even when an agent sends old events from its
+    spool; the agent's own time is kept in the detected_at column. They also
+    go to the alert coalescer, so each host still gets its own rate-limited
+    digest but all mail goes out from here. Counts by verdict, host and
+    device are kept and returned for {"type": "stats"} requests.
+    """
+
+    def __init__(self, address, audit_log, alert_coalescer=None, dedup_size=100000, index_interval=60.0,
+                 seen_ids_path=None):
+        parse_address(address)
+        self.address = address
+        self.audit_log = audit_log
+        self.alert_coalescer = alert_coalescer
+        self.dedup_size = dedup_size
+        self.index_interval = index_interval
+        self.seen = OrderedDict()
+        self.seen_ids_path = seen_ids_path
+        self.seen_ids_file = None
+        self.seen_ids_lines = 0
+        self.verdicts = Counter()
+        self.hosts = Counter()
+        self.unauthorized_devices = Counter()
+        self.duplicates = 0
+        self.invalid = 0
+        self.batches = 0
+        self.connections = 0
+        self.server = None
+        if seen_ids_path:
+            self._load_seen_ids()
+
+    # Persistent duplicate detection
+
+    def _load_seen_ids(self):
+        try:
+            with open(self.seen_ids_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    event_id = line.rstrip('\n')
+                    if event_id:
+                        self.seen[event_id] = True
+                        self.seen.move_to_end(event_id)
+                        self.seen_ids_lines += 1
+        except OSError:
+            return
+        while len(self.seen) > self.dedup_size:
+            self.seen.popitem(last=False)
+
+    def _remember_id(self, event_id):
+        self.seen[event_id] = True
+        if len(self.seen) > self.dedup_size:
+            self.seen.popitem(last=False)
+        if self.seen_ids_path:
+            if self.seen_ids_file is None:
+                self.seen_ids_file = open(self.seen_ids_path, 'a', encoding='utf-8')
+            self.seen_ids_file.write(f"{event_id}\n")
+            self.seen_ids_lines += 1
+
+    def _sync_seen_ids(self):
+        """Flush remembered ids; called after the log is flushed and before a batch is acknowledged"""
+        if self.seen_ids_file is None:
+            return
+        if self.seen_ids_lines > 2 * self.dedup_size:
+            # Compact: rewrite the file with just the ids still remembered
+            self.seen_ids_file.close()
+            temp_path = self.seen_ids_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.writelines(f"{event_id}\n" for event_id in self.seen)
+            os.replace(temp_path, self.seen_ids_path)
+            self.seen_ids_lines = len(self.seen)
+            self.seen_ids_file = open(self.seen_ids_path, 'a', encoding='utf-8')
+        else:
+            self.seen_ids_file.flush()
+
+    def process_event(self, event):
+        """Record one event; returns False when it is a duplicate or malformed"""
+        device = event.get('device') if isinstance(event, dict) else None
+        if not isinstance(device, dict) or not device.get('vendor_id') or not device.get('product_id'):
+            # Skipped rather than refused, so one bad event cannot make an agent resend forever
+            self.invalid += 1
+            return False
+
+        event_id = event.get('id')
+        if event_id is not None:
+            event_id = str(event_id)
+            if event_id in self.seen:
+                self.duplicates += 1
+                return False
+            self._remember_id(event_id)
+
+        host = event.get('host', 'unknown')
+        verdict = event.get('verdict', 'unauthorized')
+        self.verdicts[verdict] += 1
+        self.hosts[host] += 1
+        if verdict != 'unauthorized':
+            return True
+
+        device = dict(device, system=host, user=event.get('user'))
+        device[DETECTED_AT_FIELD] = event.get('timestamp') or ''
+        device.setdefault('device_name', 'Unknown USB Device')
+        self.unauthorized_devices[f"{device.get('vendor_id', '')}:{device.get('product_id', '')}"] += 1
+        self.audit_log.write(device)
+        if self.alert_coalescer is not None:
+            self.alert_coalescer.submit(device, host)
+        return True
+
+    def stats(self):
+        return {
+            'verdicts': dict(self.verdicts),
+            'hosts': dict(self.hosts),
+            'top_unauthorized_devices': self.unauthorized_devices.most_common(10),
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'batches': self.batches,
+            'connections': self.connections
+        }
+
+    async def handle_client(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    break
+                if message.get('type') == 'batch':
+                    for event in message.get('events', []):
+                        self.process_event(event)
+                    # Rows reach the log before their ids are remembered, and
+                    # both before the ack, so a crash can only cause a resend
+                    self.audit_log.flush()
+                    self._sync_seen_ids()
+                    self.batches += 1
+                    reply = {'type': 'ack', 'seq': message.get('seq')}
+                elif message.get('type') == 'stats':
+                    reply = dict(self.stats(), type='stats')
+                else:
+                    reply = {'type': 'error', 'error': 'unknown message type'}
+                writer.write((json.dumps(reply) + '\n').encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+            print(f"Fleet agent connection dropped: {e}")
+        except asyncio.CancelledError:
+            # The collector is shutting down; the agent resends anything unacknowledged
+            pass
+        finally:
+            writer.close()
+
+    def _refresh_index(self):
+        self.audit_log.flush()
+        if os.path.exists(self.audit_log.path):
+            build_index(self.audit_log.path)
+
+    async def _index_loop(self):
+        while True:
+            await asyncio.sleep(self.index_interval)
+            try:
+                await asyncio.to_thread(self._refresh_index)
+            except Exception as e:
+                print(f"Error indexing fleet log: {e}")
+
+    async def serve(self, ready=None):
+        """Accept agents until cancelled; ready (an asyncio.Event) is set once listening"""
+        family, target = parse_address(self.address)
+        if family == 'unix':
+            if os.path.exists(target):
+                os.remove(target)
+            self.server = await asyncio.start_unix_server(self.handle_client, target, limit=MAX_LINE_BYTES)
+        else:
+            self.server = await asyncio.start_server(self.handle_client, *target, limit=MAX_LINE_BYTES)
+        if ready is not None:
+            ready.set()
+
+        index_task = asyncio.create_task(self._index_loop()) if self.index_interval else None
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            if index_task is not None:
+                index_task.cancel()
+
+    def bound_address(self):
+        """The address actually listened on, e.g. to find the port chosen for port 0"""
+        sockname = self.server.sockets[0].getsockname()
+        return f"unix:{sockname}" if isinstance(sockname, str) else f"{sockname[0]}:{sockname[1]}"
+
+    def close(self):
+        """Write out the log and refresh its index; call once serving has stopped"""
+        if self.seen_ids_file is not None:
+            self.seen_ids_file.close()
+            self.seen_ids_file = None
+        self.audit_log.close()
+        if self.index_interval and os.path.exists(self.audit_log.path):
+            build_index(self.audit_log.path)
+
+
+def query_stats(address, timeout=10):
+    """Ask a running collector for its counters"""
+    with open_connection(address, timeout) as sock:
+        sock.sendall(b'{"type": "stats"}\n')
+        with sock.makefile('rb') as reader:
+            return json.loads(reader.readline())
+
+
+def run_collector(args):
+    audit_log = AuditLogWriter(args.log_file, log_format=args.log_format, extra_fields=(DETECTED_AT_FIELD,))
+    dispatcher = None
+    coalescer = None
+    suppression_log = None
+    if args.email_config:
+        with open(args.email_config) as f:
+            email_config = json.load(f)
+        dispatcher = AlertDispatcher(email_config, spool_dir=args.alert_spool_dir)
+        suppression_log = AuditLogWriter(args.suppression_log, log_format='jsonl')
+        coalescer = AlertCoalescer(
+            lambda detections, host, suppressed: build_alert_message(email_config, detections, host, suppressed),
+            dispatcher,
+            window=email_config.get('digest_window', 5),
+            max_per_hour=email_config.get('max_alerts_per_hour', 20),
+            burst=email_config.get('alert_burst', 5),
+            suppression_log=suppression_log)
+    else:
+        print("No --email-config given; unauthorized devices are logged but not emailed")
+
+    collector = FleetCollector(args.listen, audit_log, coalescer, index_interval=args.index_interval,
+                               seen_ids_path=args.log_file + SEEN_IDS_SUFFIX)
+    audit_log.start()
+    if dispatcher is not None:
+        dispatcher.start()
+    print(f"Fleet collector listening on {args.listen}, logging to {args.log_file}")
+    try:
+        asyncio.run(collector.serve())
+    except KeyboardInterrupt:
+        print("\nFleet collector stopped by user")
+    finally:
+        if coalescer is not None:
+            coalescer.close()
+            dispatcher.stop()
+            suppression_log.close()
+        collector.close()
+        print(json.dumps(collector.stats(), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect USB device events from many hosts")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    collector = subparsers.add_parser('collector', help="receive events from agents")
+    collector.add_argument('--listen', default='127.0.0.1:7070',
+                           help="host:port or unix:/path to listen on (default 127.0.0.1:7070)")
+    collector.add_argument('--log-file', default=DEFAULT_LOG_FILE, help="fleet-wide unauthorized device log")
+    collector.add_argument('--log-format', choices=['csv', 'jsonl'],
+                           help="log format (default: from the log file extension)")
+    collector.add_argument('--index-interval', type=float, default=60.0,
+                           help="refresh the log's time index this often (seconds, 0 disables)")
+    collector.add_argument('--email-config', help="JSON file with the SMTP settings for alert emails")
+    collector.add_argument('--alert-spool-dir', default=DEFAULT_COLLECTOR_SPOOL_DIR,
+                           help="where alert emails wait until they are delivered")
+    collector.add_argument('--suppression-log', default=DEFAULT_SUPPRESSION_LOG,
+                           help="JSON Lines record of digests held back by the alert rate limit")
+
+    stats = subparsers.add_parser('stats', help="print a running collector's counters")
+    stats.add_argument('address', help="collector address, host:port or unix:/path")
+
+    args = parser.parse_args()
+
+    if args.command == 'collector':
+        try:
+            parse_address(args.listen)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        run_collector(args)
+    elif args.command == 'stats':
+        print(json.dumps(query_stats(args.address), indent=2))
+
+
+if __name__ == "__main__":
+    main()
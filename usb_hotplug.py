@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+import errno
+import os
+import platform
+import queue
+import select
+import socket
+import time
+
+# Netlink protocol used by the kernel to broadcast kobject uevents
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast group 1 carries the raw kernel events (udev rebroadcasts on group 2)
+UEVENT_KERNEL_GROUP = 1
+
+
+def parse_uevent(data):
+    """Parse a raw kernel uevent datagram into an event dictionary"""
+    # Example: b'add@/devices/pci0000:00/.../1-1\x00ACTION=add\x00DEVPATH=...\x00SUBSYSTEM=usb\x00...'
+    if data.startswith(b'libudev'):
+        # udev rebroadcasts use a binary header; we only listen to the kernel group
+        return None
+
+    fields = data.split(b'\x00')
+    event = {}
+    for field in fields[1:]:
+        if b'=' in field:
+            key, value = field.split(b'=', 1)
+            event[key.decode('utf-8', 'replace')] = value.decode('utf-8', 'replace')
+
+    if 'ACTION' not in event:
+        return None
+
+    return {
+        'action': event.get('ACTION', ''),
+        'devpath': event.get('DEVPATH', ''),
+        'subsystem': event.get('SUBSYSTEM', ''),
+        'devtype': event.get('DEVTYPE', ''),
+        'product': event.get('PRODUCT', '')
+    }
+
+
+class NetlinkUeventSource:
+    """Receive USB add/remove events from the kernel over a netlink socket"""
+
+    def __init__(self, settle_time=0.05):
+        # Hubs and docks announce several children at once; wait this long for
+        # the rest of a burst so one rescan covers all of them
+        self.settle_time = settle_time
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+            self.sock.bind((0, UEVENT_KERNEL_GROUP))
+        except Exception:
+            self.sock.close()
+            raise
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _read_pending(self, events):
+        """Drain every datagram that is already queued on the socket"""
+        while True:
+            try:
+                data = self.sock.recv(65536, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # The kernel dropped events because we fell behind, so the
+                    # caller has to resynchronise with a full scan
+                    events.append({'action': 'resync', 'devpath': '', 'subsystem': 'usb',
+                                   'devtype': '', 'product': ''})
+                    continue
+                raise
+
+            event = parse_uevent(data)
+            if event and event['subsystem'] == 'usb' and event['devtype'] == 'usb_device':
+                if event['action'] in ('add', 'remove'):
+                    events.append(event)
+
+    def wait_for_events(self, timeout=None):
+        """Block until USB devices are added or removed; returns a list of events"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        events = []
+
+        while not events:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                return events
+            self._read_pending(events)
+
+        # Collect the rest of the burst before handing the events over
+        while select.select([self.sock], [], [], self.settle_time)[0]:
+            self._read_pending(events)
+
+        return events
+
+    def close(self):
+        self.sock.close()
+
+
+class QueueEventSource:
+    """Event source fed from Python code instead of the kernel (tests, replays)
+
+    Any object with wait_for_events(timeout) and close() can drive
+    USBAuthorizationSystem.monitor_usb_devices. Returning None from
+    wait_for_events ends monitoring, as a finished trace replay does.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def put(self, action, devpath='', subsystem='usb', devtype='usb_device', product=''):
+        """Queue a fake uevent; action is 'add', 'remove' or 'resync'"""
+        self.events.put({
+            'action': action,
+            'devpath': devpath,
+            'subsystem': subsystem,
+            'devtype': devtype,
+            'product': product
+        })
+
+    def wait_for_events(self, timeout=None):
+        """Return all queued events, blocking for the first one up to timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Wait in short slices so Ctrl+C is still delivered to the main thread
+            remaining = 0.5 if deadline is None else min(0.5, max(0, deadline - time.monotonic()))
+            try:
+                events = [self.events.get(timeout=remaining)]
+                break
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return []
+
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self):
+        pass
+
+
+def create_hotplug_source():
+    """Return a kernel hotplug event source, or None when only polling is possible"""
+    if platform.system() != 'Linux' or not hasattr(socket, 'AF_NETLINK'):
+        return None
+
+    try:
+        return NetlinkUeventSource()
+    except OSError as e:
+        print(f"Hotplug events unavailable ({e}), falling back to polling")
+        return None
+
+
+def describe_event(event):
+    """Short human readable description of a hotplug event"""
+    devname = os.path.basename(event.get('devpath', '')) or 'unknown'
+    return f"{event.get('action', '?')} {devname}"
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+import marshal
+import os
+import re
+import sys
+from functools import lru_cache
+
+# Where distributions install the usb.ids database
+USB_IDS_PATHS = [
+    '/usr/share/hwdata/usb.ids',
+    '/usr/share/misc/usb.ids',
+    '/usr/share/usb.ids',
+    '/usr/share/usbutils/usb.ids',
+    '/var/lib/usbutils/usb.ids'
+]
+# Bump when the cached index layout changes
+INDEX_VERSION = 1
+
+VENDOR_LINE = re.compile(r'^([0-9a-fA-F]{4})\s+(.+)$')
+PRODUCT_LINE = re.compile(r'^\t([0-9a-fA-F]{4})\s+(.+)$')
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'usb_theft')
+
+
+def parse_usb_ids(lines):
+    """Build {'vvvv': vendor name, 'vvvv:pppp': product name} from usb.ids lines"""
+    names = {}
+    vendor_id = None
+    for line in lines:
+        if not line.strip() or line.startswith('#'):
+            continue
+        if line.startswith('\t'):
+            # Products belong to the vendor above; deeper levels are interfaces
+            if vendor_id and not line.startswith('\t\t'):
+                match = PRODUCT_LINE.match(line.rstrip('\n'))
+                if match:
+                    names[f"{vendor_id}:{match.group(1).lower()}"] = match.group(2).strip()
+            continue
+        match = VENDOR_LINE.match(line.rstrip('\n'))
+        if not match:
+            # The vendor list is followed by class, language and HID tables
+            break
+        vendor_id = match.group(1).lower()
+        names[vendor_id] = match.group(2).strip()
+    return names
+
+
+class UsbIdsResolver:
+    """Resolves vendor and product names from usb.ids, loaded on first use
+
+    The parsed table is cached on disk, keyed by the source file's path,
+    size and mtime, so later runs load it with one marshal read instead of
+    parsing the ~20k line text file. Lookups are memoized in an LRU cache.
+    """
+
+    def __init__(self, path=None, cache_dir=None, cache_size=1024):
+        self.path = path
+        self.cache_dir = cache_dir or default_cache_dir()
+        self._names = None
+        self.vendor_name = lru_cache(maxsize=cache_size)(self._vendor_name)
+        self.product_name = lru_cache(maxsize=cache_size)(self._product_name)
+
+    def _source_path(self):
+        if self.path:
+            return self.path if os.path.isfile(self.path) else None
+        for path in USB_IDS_PATHS:
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _cache_path(self, source):
+        import hashlib
+        digest = hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f"usb_ids-{digest}.marshal")
+
+    def _read_cache(self, cache_path, signature):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(cached, tuple) or len(cached) != 2 or cached[0] != signature:
+            return None
+        return cached[1]
+
+    def _write_cache(self, cache_path, signature, names):
+        # Only needed when the cache is rebuilt, so not imported at load time
+        import tempfile
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((signature, names), f)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            # Caching is only an optimisation
+            pass
+
+    def load(self):
+        """Load the name table, from the cache when the source file is unchanged"""
+        if self._names is not None:
+            return self._names
+
+        source = self._source_path()
+        if source is None:
+            self._names = {}
+            return self._names
+
+        stat = os.stat(source)
+        signature = (INDEX_VERSION, sys.version_info[:2], os.path.abspath(source),
+                     stat.st_size, stat.st_mtime_ns)
+        cache_path = self._cache_path(source)
+
+        names = self._read_cache(cache_path, signature)
+        if names is None:
+            with open(source, 'r', encoding='utf-8', errors='replace') as f:
+                names = parse_usb_ids(f)
+            self._write_cache(cache_path, signature, names)
+
+        self._names = names
+        return names
+
+    def _vendor_name(self, vendor_id):
+        return self.load().get(vendor_id.lower())
+
+    def _product_name(self, vendor_id, product_id):
+        return self.load().get(f"{vendor_id.lower()}:{product_id.lower()}")
+
+    def split_device_name(self, vendor_id, product_id, device_name):
+        """Split lsusb's "<vendor> <product>" text into (manufacturer, product name)
+
+        Uses the usb.ids names so multi-word vendors such as "Western
+        Digital Technologies, Inc." stay intact; falls back to splitting at
+        the first space when the names are not known.
+        """
+        vendor = self.vendor_name(vendor_id)
+        if vendor and device_name.startswith(vendor):
+            return vendor, device_name[len(vendor):].strip() or device_name
+
+        product = self.product_name(vendor_id, product_id)
+        if product and device_name.endswith(product) and len(device_name) > len(product):
+            return device_name[:-len(product)].strip(), product
+
+        parts = device_name.split(' ', 1)
+        return parts[0], parts[1] if len(parts) > 1 else device_name
+
+
+_default_resolver = None
+
+
+def get_resolver():
+    """Shared resolver using the system usb.ids; nothing is read until a name is needed"""
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = UsbIdsResolver()
+    return _default_resolver
@@ -0,0 +1,316 @@
+#!/usr/bin/python3
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+import zlib
+from collections import Counter
+
+from usb_audit_log import LOG_FIELDNAMES, log_format_for
+
+INDEX_SUFFIX = '.idx'
+INDEX_HEADER = '# usb-log-index v3'
+# Bytes at the start of the log the index fingerprints to notice rotation
+INDEX_HEAD_BYTES = 4096
+
+
+def _open_binary(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def _log_format(path):
+    return log_format_for(path[:-3] if path.endswith('.gz') else path)
+
+
+def normalize_bound(value, end=False):
+    """Turn a 'YYYY-MM-DD[ HH[:MM[:SS]]]' bound into a comparable timestamp string"""
+    if value is None:
+        return None
+    value = value.strip().replace('T', ' ')
+    template = '0000-01-01 23:59:59' if end else '0000-01-01 00:00:00'
+    return value + template[len(value):]
+
+
+def _line_timestamp(line, log_format):
+    """Timestamp of one raw log line, or None for headers and unparsable lines"""
+    if log_format == 'jsonl':
+        try:
+            return json.loads(line).get('timestamp')
+        except (ValueError, AttributeError):
+            return None
+    timestamp = line.split(b',', 1)[0].decode('utf-8', 'replace').strip('"')
+    return timestamp if timestamp[:1].isdigit() else None
+
+
+# Sidecar time index: the byte offset of the first row of every hour
+
+def index_path_for(path):
+    return path + INDEX_SUFFIX
+
+
+def _head_fingerprint(path, size):
+    """Checksum of the first bytes of the log, up to size, which rotation replaces"""
+    with open(path, 'rb') as f:
+        return f"{zlib.crc32(f.read(min(size, INDEX_HEAD_BYTES))):08x}"
+
+
+def _read_index(path):
+    """Return (indexed size, head fingerprint, ordered, last timestamp, [(hour, offset), ...])
+
+    or None without a usable index.
+    """
+    try:
+        with open(index_path_for(path), 'r') as f:
+            header = f.readline().split()
+            if header[:3] != INDEX_HEADER.split():
+                return None
+            fields = dict(field.split('=', 1) for field in header[3:])
+            size = int(fields['size'])
+            head = fields['head']
+            ordered = fields['ordered'] == '1'
+            # Timestamps contain a space, which is stored as 'T'
+            last_timestamp = fields['last'].replace('T', ' ') or None
+            entries = []
+            for line in f:
+                hour, offset = line.rsplit(' ', 1)
+                entries.append((hour, int(offset)))
+            return size, head, ordered, last_timestamp, entries
+    except (OSError, ValueError, IndexError, KeyError):
+        return None
+
+
+def build_index(path):
+    """Create or extend the sidecar time index for a log file; returns the index entries
+
+    The log is append-only, so when it only grew just the new rows are
+    scanned. A log that shrank or whose first bytes changed (rotated or
+    rewritten) is indexed again.
+
+    Seeking by hour only works while timestamps never go backwards, which a
+    clock step, a DST change in local-time logs or late-arriving rows can
+    break. The index records whether every row so far was in order; when
+    one was not, queries read the whole file instead of trusting it.
+    """
+    if path.endswith('.gz'):
+        raise ValueError("compressed log segments cannot be indexed")
+
+    log_format = _log_format(path)
+    size = os.path.getsize(path)
+    existing = _read_index(path)
+    if existing is not None and existing[0] <= size and existing[1] == _head_fingerprint(path, existing[0]):
+        start, _, ordered, last_timestamp, entries = existing
+    else:
+        start, ordered, last_timestamp, entries = 0, True, None, []
+    last_hour = entries[-1][0] if entries else None
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if not line.endswith(b'\n'):
+                # Row still being written; index it next time
+                break
+            timestamp = _line_timestamp(line, log_format)
+            if timestamp:
+                if last_timestamp is not None and timestamp < last_timestamp:
+                    ordered = False
+                last_timestamp = timestamp
+                hour = timestamp[:13]
+                if hour != last_hour:
+                    entries.append((hour, offset))
+                    last_hour = hour
+            offset += len(line)
+
+    temp_path = index_path_for(path) + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(f"{INDEX_HEADER} size={offset} head={_head_fingerprint(path, offset)} ordered={int(ordered)} "
+                f"last={(last_timestamp or '').replace(' ', 'T')}\n")
+        for hour, entry_offset in entries:
+            f.write(f"{hour} {entry_offset}\n")
+    os.replace(temp_path, index_path_for(path))
+    return entries
+
+
+def _seek_offset(path, since):
+    """Return (byte offset to start reading from for rows at or after since, whether the log is in order)
+
+    Without an index, or with one that found rows out of order, the whole
+    file has to be read: (0, False).
+    """
+    existing = _read_index(path)
+    if existing is None:
+        return 0, False
+    if existing[0] != os.path.getsize(path) or existing[1] != _head_fingerprint(path, existing[0]):
+        build_index(path)
+        existing = _read_index(path)
+        if existing is None:
+            return 0, False
+    _, _, ordered, _, entries = existing
+    if not ordered:
+        return 0, False
+
+    since_hour = since[:13]
+    offset = 0
+    # Entries are in file order and hours only increase, so binary search
+    low, high = 0, len(entries)
+    while low < high:
+        middle = (low + high) // 2
+        if entries[middle][0] <= since_hour:
+            low = middle + 1
+        else:
+            high = middle
+    if low:
+        offset = entries[low - 1][1]
+    return offset, True
+
+
+# Streaming reader
+
+def iter_rows(path, start_offset=0):
+    """Yield log rows as dictionaries, one at a time"""
+    log_format = _log_format(path)
+    with _open_binary(path) as f:
+        if log_format == 'jsonl':
+            f.seek(start_offset)
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+            return
+
+        lines = (line.decode('utf-8', 'replace') for line in f)
+        header = next(csv.reader(lines), None)
+        if not header:
+            return
+        if start_offset:
+            f.seek(start_offset)
+            lines = (line.decode('utf-8', 'replace') for line in f)
+        for values in csv.reader(lines):
+            if values:
+                yield dict(zip(header, values))
+
+
+def iter_events(path, since=None, until=None, host=None, user=None, device=None, use_index=True):
+    """Yield log rows matching every given filter
+
+    since/until take 'YYYY-MM-DD[ HH:MM:SS]'; device takes 'vid:pid' or just
+    'vid'. When the log has a sidecar index (see build_index) and since is
+    given, reading starts at the first indexed hour that can match instead
+    of the top of the file, unless the index found rows out of order.
+    """
+    since = normalize_bound(since)
+    until = normalize_bound(until, end=True)
+    vendor_id, _, product_id = (device or '').lower().partition(':')
+
+    start_offset = 0
+    ordered = False
+    if use_index and since and not path.endswith('.gz'):
+        start_offset, ordered = _seek_offset(path, since)
+
+    for row in iter_rows(path, start_offset):
+        timestamp = row.get('timestamp', '')
+        if since and timestamp < since:
+            continue
+        if until and timestamp > until:
+            if ordered:
+                # The index confirmed the log is in time order, so nothing later can match
+                return
+            continue
+        if host and row.get('system') != host:
+            continue
+        if user and row.get('user') != user:
+            continue
+        if vendor_id and row.get('vendor_id', '').lower() != vendor_id:
+            continue
+        if product_id and row.get('product_id', '').lower() != product_id:
+            continue
+        yield row
+
+
+# Aggregates
+
+GROUP_KEYS = {
+    'device': lambda row: f"{row.get('vendor_id', '')}:{row.get('product_id', '')}",
+    'host': lambda row: row.get('system', ''),
+    'user': lambda row: row.get('user', ''),
+    'name': lambda row: row.get('device_name', '')
+}
+
+
+def top_n(rows, by='device', n=10):
+    """Most frequent values of a grouping key; memory grows with distinct values, not rows"""
+    key = GROUP_KEYS[by]
+    return Counter(key(row) for row in rows).most_common(n)
+
+
+def hourly_counts(rows):
+    """Number of events per hour, in time order"""
+    counts = Counter(row.get('timestamp', '')[:13] for row in rows)
+    return sorted(counts.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the unauthorized USB device log")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument('log_file', help="log file (.csv, .jsonl, optionally .gz)")
+    filters.add_argument('--since', help="only events at or after 'YYYY-MM-DD[ HH:MM:SS]'")
+    filters.add_argument('--until', help="only events at or before 'YYYY-MM-DD[ HH:MM:SS]'")
+    filters.add_argument('--host', help="only events from this system")
+    filters.add_argument('--user', help="only events from this user")
+    filters.add_argument('--device', help="only this device, as vid:pid or vid")
+    filters.add_argument('--no-index', action='store_true', help="ignore the sidecar time index")
+
+    query = subparsers.add_parser('query', parents=[filters], help="print matching events")
+    query.add_argument('--limit', type=int, help="stop after this many events")
+    query.add_argument('--json', action='store_true', help="print JSON Lines instead of CSV")
+
+    top = subparsers.add_parser('top', parents=[filters], help="most frequent devices, hosts or users")
+    top.add_argument('--by', choices=sorted(GROUP_KEYS), default='device')
+    top.add_argument('-n', type=int, default=10, help="number of entries to show")
+
+    subparsers.add_parser('hourly', parents=[filters], help="number of events per hour")
+
+    index = subparsers.add_parser('index', help="create or update the sidecar time index")
+    index.add_argument('log_file', help="log file to index")
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.log_file):
+        print(f"Error: log file '{args.log_file}' not found.")
+        sys.exit(1)
+
+    if args.command == 'index':
+        entries = build_index(args.log_file)
+        print(f"Indexed {len(entries)} hours of {args.log_file}")
+        return
+
+    rows = iter_events(args.log_file, since=args.since, until=args.until, host=args.host,
+                       user=args.user, device=args.device, use_index=not args.no_index)
+
+    if args.command == 'query':
+        writer = None if args.json else csv.DictWriter(sys.stdout, fieldnames=LOG_FIELDNAMES,
+                                                        extrasaction='ignore')
+        if writer:
+            writer.writeheader()
+        for count, row in enumerate(rows, 1):
+            if writer:
+                writer.writerow(row)
+            else:
+                print(json.dumps(row))
+            if args.limit and count >= args.limit:
+                break
+    elif args.command == 'top':
+        for value, count in top_n(rows, args.by, args.n):
+            print(f"{count:>8}  {value}")
+    elif args.command == 'hourly':
+        for hour, count in hourly_counts(rows):
+            print(f"{hour}:00  {count:>8}")
+
+
+if __name__ == "__main__":
+    main()
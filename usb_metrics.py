@@ -0,0 +1,304 @@
+#!/usr/bin/python3
+import os
+import signal
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class for metrics with optional labels"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def samples(self):
+        """Yield (suffix, label values, extra label, value) tuples"""
+        with self._lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield '', key, None, value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.label_names, key, extra)} "
+                         f"{_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """Read the value from function() each time metrics are collected"""
+        self.function = function
+
+    def get(self, **labels):
+        if self.function is not None:
+            return self.function()
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                yield '', (), None, self.function()
+            except Exception:
+                pass
+            return
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        """Context manager that observes the duration of its block"""
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        counts, _ = self.values.get(self._key(labels), ([0] * len(self.buckets), 0.0))
+        return counts[-1]
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        for key, counts, total in items:
+            for bound, count in zip(self.buckets, counts):
+                yield '_bucket', key, ('le', _format_value(bound)), count
+            yield '_sum', key, None, total
+            yield '_count', key, None, counts[-1]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """A set of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Scanning
+SCAN_DURATION = REGISTRY.histogram(
+    'usb_scan_duration_seconds', 'Time for one full scan: enumeration, diff and decisions')
+ENUMERATION_DURATION = REGISTRY.histogram(
+    'usb_enumeration_duration_seconds', 'Time spent listing connected devices', labels=('source',))
+DEVICES_ATTACHED = REGISTRY.gauge('usb_devices_attached', 'Devices attached at the last scan')
+DEVICE_CHANGES = REGISTRY.counter('usb_device_changes_total', 'Device arrivals and departures',
+                                  labels=('change',))
+HOTPLUG_EVENTS = REGISTRY.counter('usb_hotplug_events_total', 'Kernel hotplug events received',
+                                  labels=('action',))
+DECISIONS = REGISTRY.counter('usb_authorization_decisions_total', 'Authorization decisions',
+                             labels=('verdict',))
+
+# Allowlist
+ALLOWLIST_ENTRIES = REGISTRY.gauge('usb_allowlist_entries', 'Entries in the authorized device list')
+ALLOWLIST_RELOAD_DURATION = REGISTRY.histogram(
+    'usb_allowlist_reload_seconds', 'Time to reload the authorized device list', labels=('kind',))
+
+# Alerts
+ALERT_QUEUE_DEPTH = REGISTRY.gauge('usb_alert_queue_depth', 'Alerts waiting to be delivered')
+ALERT_SEND_DURATION = REGISTRY.histogram('usb_alert_send_seconds', 'Time to deliver one alert email')
+ALERTS_SENT = REGISTRY.counter('usb_alerts_sent_total', 'Alert emails delivered')
+ALERT_SEND_FAILURES = REGISTRY.counter('usb_alert_send_failures_total', 'Failed alert delivery attempts')
+ALERTS_SUPPRESSED = REGISTRY.counter('usb_alert_digests_suppressed_total',
+                                     'Digest emails held back by the alert rate limit')
+
+# Event stream
+STREAM_EVENTS_WRITTEN = REGISTRY.counter('usb_event_stream_written_total', 'Events written to the event stream')
+STREAM_EVENTS_DROPPED = REGISTRY.counter('usb_event_stream_dropped_total',
+                                         'Events dropped because the event stream consumer fell behind')
+
+
+# The servers and the profiler are imported when first used, so a process
+# that never serves metrics does not pay for http.server or cProfile
+
+def start_metrics_server(port, host='127.0.0.1', registry=REGISTRY):
+    """Serve /metrics over HTTP from a background thread; returns the server"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHTTPHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = self.server.registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Keep scrapes out of the monitor's console output
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHTTPHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def start_metrics_socket(path, registry=REGISTRY):
+    """Write the metrics to every client that connects to a Unix socket; returns the server"""
+    import socketserver
+
+    class MetricsSocketHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write(self.server.registry.render().encode('utf-8'))
+
+    class UnixMetricsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(path):
+        os.remove(path)
+    server = UnixMetricsServer(path, MetricsSocketHandler)
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name='metrics-socket', daemon=True).start()
+    return server
+
+
+class TickProfiler:
+    """Profiles a single monitor tick on request (SIGUSR1 by default)
+
+    The signal only sets a flag; the next tick runs under cProfile and its
+    hottest functions are written to a file in output_dir.
+    """
+
+    def __init__(self, output_dir='.', limit=40):
+        self.output_dir = output_dir
+        self.limit = limit
+        self.requested = False
+
+    def install(self, signum=None):
+        """Profile the next tick whenever signum arrives; returns False if unsupported"""
+        signum = signum if signum is not None else getattr(signal, 'SIGUSR1', None)
+        if signum is None:
+            return False
+        signal.signal(signum, lambda *args: self.request())
+        return True
+
+    def request(self):
+        self.requested = True
+
+    def run(self, function, *args, **kwargs):
+        """Call function, profiling it if a profile was requested"""
+        if not self.requested:
+            return function(*args, **kwargs)
+
+        self.requested = False
+        import cProfile
+        import io
+        import pstats
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            output = io.StringIO()
+            stats = pstats.Stats(profiler, stream=output)
+            stats.sort_stats('cumulative').print_stats(self.limit)
+            path = os.path.join(self.output_dir,
+                                f"usb_tick_profile_{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt")
+            with open(path, 'w') as f:
+                f.write(f"Tick duration: {elapsed * 1000:.2f} ms\n")
+                f.write(output.getvalue())
+            print(f"Tick profile written to {path}")
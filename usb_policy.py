@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+import json
+import platform
+from datetime import datetime
+from fnmatch import fnmatchcase
+from functools import lru_cache
+
+from usb_allowlist import WILDCARD, AuthorizedDeviceIndex, normalize_serial
+from usb_sysfs import class_code
+
+ACTIONS = ('allow', 'deny')
+# Rule levels, most specific first; a match at an earlier level always wins
+LEVELS = ('serial', 'product', 'vendor', 'class', 'any')
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
+def parse_time_window(rule):
+    """Return (weekdays, start minute, end minute) from a rule's days/hours, or None"""
+    days = rule.get('days')
+    hours = rule.get('hours')
+    if days is None and hours is None:
+        return None
+
+    weekdays = None
+    if days is not None:
+        try:
+            weekdays = frozenset(DAYS.index(day.strip().lower()[:3]) for day in days)
+        except ValueError:
+            raise ValueError(f"days must be taken from {', '.join(DAYS)}")
+
+    start, end = 0, 24 * 60
+    if hours is not None:
+        try:
+            start, end = (int(hh) * 60 + int(mm) for hh, mm in
+                          (part.strip().split(':') for part in hours.split('-')))
+        except ValueError:
+            raise ValueError(f"hours must look like '08:00-18:00', not '{hours}'")
+    return weekdays, start, end
+
+
+def window_active(window, now):
+    """True when now falls inside a window from parse_time_window"""
+    weekdays, start, end = window
+    minute = now.hour * 60 + now.minute
+    if start <= end:
+        in_hours = start <= minute < end
+        day = now.weekday()
+    else:
+        # Wraps past midnight, e.g. 18:00-08:00; the early hours belong to the previous day's window
+        in_hours = minute >= start or minute < end
+        day = now.weekday() if minute >= start else (now.weekday() - 1) % 7
+    return in_hours and (weekdays is None or day in weekdays)
+
+
+def host_matches(patterns, host):
+    return any(fnmatchcase(host.lower(), pattern.lower()) for pattern in patterns)
+
+
+def compile_rule(rule, position):
+    """Check one policy rule; returns (level, key, (action, hosts, window, position, reason))"""
+    action = rule.get('action', '').lower()
+    if action not in ACTIONS:
+        raise ValueError(f"rule {position + 1}: action must be 'allow' or 'deny'")
+
+    vendor_id = rule.get('vendor_id', '').strip().lower()
+    product_id = rule.get('product_id', '').strip().lower()
+    serial_number = normalize_serial(rule.get('serial_number'))
+    classes = rule.get('interface_class')
+
+    if classes is not None:
+        if vendor_id or product_id or serial_number:
+            raise ValueError(f"rule {position + 1}: interface_class cannot be combined with device ids")
+        if isinstance(classes, str):
+            classes = [classes]
+        level, key = 'class', tuple(class_code(value) for value in classes)
+        description = f"interface class {', '.join(key)}"
+    elif serial_number:
+        if not vendor_id or not product_id:
+            raise ValueError(f"rule {position + 1}: serial_number needs vendor_id and product_id")
+        level, key = 'serial', (vendor_id, product_id, serial_number)
+        description = f"device {vendor_id}:{product_id} serial {serial_number}"
+    elif product_id and product_id != WILDCARD:
+        if not vendor_id:
+            raise ValueError(f"rule {position + 1}: product_id needs vendor_id")
+        level, key = 'product', (vendor_id, product_id)
+        description = f"device {vendor_id}:{product_id}"
+    elif vendor_id:
+        level, key = 'vendor', vendor_id
+        description = f"vendor {vendor_id}"
+    else:
+        level, key = 'any', None
+        description = "any device"
+
+    hosts = rule.get('hosts')
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    try:
+        window = parse_time_window(rule)
+    except ValueError as e:
+        raise ValueError(f"rule {position + 1}: {e}")
+
+    reason = rule.get('name') or f"rule {position + 1}: {action} {description}"
+    return level, key, (action, tuple(hosts) if hosts else None, window, position, reason)
+
+
+def load_policy(path):
+    """Read a JSON policy file"""
+    with open(path, 'r') as f:
+        policy = json.load(f)
+    if not isinstance(policy, dict):
+        raise ValueError("the policy file must contain a JSON object")
+    return policy
+
+
+class PolicyEngine:
+    """Decides whether a device may be used, from policy rules and the authorized list
+
+    A policy is a JSON object:
+
+        {
+          "default": "deny",
+          "departments": {"Finance": ["fin-*"], "IT": ["*"]},
+          "rules": [
+            {"action": "deny", "interface_class": "mass-storage"},
+            {"action": "allow", "interface_class": ["hid", "hub"]},
+            {"action": "allow", "vendor_id": "046d", "hours": "08:00-18:00", "days": ["mon", "fri"]},
+            {"action": "deny", "vendor_id": "0781", "product_id": "5583", "serial_number": "X1"},
+            {"action": "allow", "hosts": ["lab-*"], "name": "lab machines take other devices"}
+          ]
+        }
+
+    Each rule matches on a serial (with vendor and product), a product, a
+    vendor, one of the device's interface classes, or on any device; hosts
+    and days/hours further limit where and when it applies. Entries in the
+    authorized list act as allow rules at their own level (serial, product
+    or vendor), except that a device registered to a department listed in
+    "departments" is denied on hosts outside that department. The most
+    specific matching rule wins and, at the same level, deny beats allow.
+    Without a policy only the authorized list is used, as before.
+
+    Rules are compiled into hash tables by level, and the candidate rules
+    for each (vendor, product, serial, classes, host) are cached in an LRU,
+    so a repeat device costs one cache hit. Only time windows are checked
+    on every evaluation, since they depend on the clock.
+    """
+
+    def __init__(self, policy=None, allowlist=None, host=None, cache_size=4096, clock=datetime.now):
+        policy = policy or {}
+        self.default = policy.get('default', 'deny').lower()
+        if self.default not in ACTIONS:
+            raise ValueError("default must be 'allow' or 'deny'")
+        self.departments = {department: tuple(hosts) for department, hosts
+                            in policy.get('departments', {}).items()}
+        self.host = host or platform.node()
+        self.clock = clock
+        self.cache_size = cache_size
+
+        self.tables = {level: {} for level in LEVELS}
+        for position, rule in enumerate(policy.get('rules', [])):
+            level, key, compiled = compile_rule(rule, position)
+            keys = key if level == 'class' else (key,)
+            for each in keys:
+                self.tables[level].setdefault(each, []).append(compiled)
+        self.rule_count = len(policy.get('rules', []))
+
+        self.set_allowlist(allowlist if allowlist is not None else AuthorizedDeviceIndex())
+
+    @classmethod
+    def from_file(cls, path, allowlist=None, **kwargs):
+        return cls(load_policy(path), allowlist, **kwargs)
+
+    def set_allowlist(self, allowlist):
+        """Use a new authorized list; cached decisions are dropped in the same step"""
+        self.allowlist = allowlist
+        # A fresh cache rather than cache_clear(), so a decision being built
+        # from the old list can never land in the new cache
+        self._decide = lru_cache(maxsize=self.cache_size)(self._build_decision)
+
+    def cache_info(self):
+        return self._decide.cache_info()
+
+    def _allowlist_candidate(self, vendor_id, product_id, serial_number, host):
+        """The authorized list entry as (level, candidate), or None when the device is not listed"""
+        device = {'vendor_id': vendor_id, 'product_id': product_id}
+        if serial_number is not None:
+            device['serial_number'] = serial_number
+        entry = self.allowlist.lookup(device)
+        if entry is None:
+            return None
+
+        if normalize_serial(entry.get('serial_number')):
+            level = 'serial'
+        elif entry.get('product_id', '') in ('', WILDCARD):
+            level = 'vendor'
+        else:
+            level = 'product'
+
+        department = entry.get('department', '')
+        hosts = self.departments.get(department)
+        if hosts and not host_matches(hosts, host):
+            return level, ('deny', None, None, self.rule_count,
+                           f"registered to department {department}, not allowed on {host}")
+        return level, ('allow', None, None, self.rule_count, "in authorized list")
+
+    def _build_decision(self, vendor_id, product_id, serial_number, classes, host):
+        """Ordered (authorized, reason, window) candidates for one device on one host"""
+        found = {level: [] for level in LEVELS}
+        if serial_number:
+            found['serial'].extend(self.tables['serial'].get((vendor_id, product_id, serial_number), ()))
+        found['product'].extend(self.tables['product'].get((vendor_id, product_id), ()))
+        found['vendor'].extend(self.tables['vendor'].get(vendor_id, ()))
+        for code in classes:
+            found['class'].extend(self.tables['class'].get(code, ()))
+        found['any'].extend(self.tables['any'].get(None, ()))
+
+        listed = self._allowlist_candidate(vendor_id, product_id, serial_number, host)
+        if listed is not None:
+            found[listed[0]].append(listed[1])
+
+        decision = []
+        for level in LEVELS:
+            # Deny first, then in file order; a rule listed under several of
+            # the device's classes only counts once
+            for action, hosts, window, position, reason in sorted(set(found[level]),
+                                                                  key=lambda c: (c[0] != 'deny', c[3])):
+                if hosts and not host_matches(hosts, host):
+                    continue
+                decision.append((action == 'allow', reason, window))
+                if window is None:
+                    # Nothing after an unconditional rule can ever apply
+                    return tuple(decision)
+
+        if self.default == 'allow':
+            decision.append((True, "allowed by default policy", None))
+        else:
+            decision.append((False, "not in authorized list", None))
+        return tuple(decision)
+
+    def evaluate(self, device, host=None):
+        """Return (authorized, reason) for a device, on this host unless another is given"""
+        classes = set(device.get('interface_classes') or ())
+        if device.get('device_class') not in (None, '', '00'):
+            classes.add(device['device_class'])
+        decision = self._decide(
+            device.get('vendor_id', '').lower(),
+            device.get('product_id', '').lower(),
+            # None when the enumerator cannot read serials (see AuthorizedDeviceIndex)
+            normalize_serial(device['serial_number']) if 'serial_number' in device else None,
+            tuple(sorted(classes)),
+            host or self.host)
+
+        now = None
+        for authorized, reason, window in decision:
+            if window is not None:
+                now = now or self.clock()
+                if not window_active(window, now):
+                    continue
+            return authorized, reason
+        # The last candidate never has a window, so this is not reached
+        return False, "no applicable rule"
+
+    def is_authorized(self, device, host=None):
+        return self.evaluate(device, host)[0]
@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+import argparse
+import csv
+import json
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+
+from usb_snapshot import device_identity
+
+TRACE_FORMAT = 'usb-monitor-trace'
+TRACE_VERSION = 1
+# Unauthorized device log used by a replay unless --log-file is given
+DEFAULT_REPLAY_LOG_FILE = 'replay_unauthorized_usb_log.csv'
+
+
+def read_trace(path):
+    """Yield (seconds since start, devices) for each record of a trace file
+
+    Records hold either parsed devices or raw lsusb output, which is parsed
+    here the same way the monitor parses it.
+    """
+    from usb_authorization import parse_lsusb_output
+
+    with open(path, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('format') != TRACE_FORMAT or header.get('version') != TRACE_VERSION:
+            raise ValueError(f"{path} is not a version {TRACE_VERSION} USB monitor trace")
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'lsusb' in record:
+                yield record['t'], parse_lsusb_output(record['lsusb'])
+            else:
+                yield record['t'], record['devices']
+
+
+class TraceRecorder:
+    """Records a monitor's device snapshots to a JSON Lines trace file
+
+    The first line is a header; every later line is {"t": seconds since
+    recording started, "devices": [...]} or, when devices were listed with
+    lsusb, {"t": ..., "lsusb": raw output}. A record is only written when
+    the set of attached devices changed, so long quiet periods cost nothing.
+    Lines are flushed as they are written, so a trace survives a crash.
+    """
+
+    def __init__(self, path, clock=time.monotonic):
+        self.path = path
+        self.clock = clock
+        self.start = None
+        self.file = None
+        self.last_identities = None
+        self.records = 0
+
+    def _open(self, source):
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self.file.write(json.dumps({
+            'format': TRACE_FORMAT,
+            'version': TRACE_VERSION,
+            'host': platform.node(),
+            'source': source,
+            'recorded_at': datetime.now().isoformat(timespec='seconds')
+        }) + '\n')
+        self.start = self.clock()
+
+    def record(self, devices, source='devices', raw_output=None):
+        """Add one device snapshot; returns False when nothing changed since the last one"""
+        identities = sorted(device_identity(device) for device in devices)
+        if identities == self.last_identities:
+            return False
+        if self.file is None:
+            self._open(source)
+        self.last_identities = identities
+
+        record = {'t': round(self.clock() - self.start, 6)}
+        if raw_output is not None:
+            record['lsusb'] = raw_output
+        else:
+            record['devices'] = devices
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        self.records += 1
+        return True
+
+    def attach(self, system):
+        """Record a USBAuthorizationSystem's snapshot after every scan and hotplug change
+
+        Hotplug changes read single sysfs entries rather than enumerating all
+        devices, so the snapshot is taken from the system's device tracker.
+        """
+        system.trace_recorder = self
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ReplayEventSource:
+    """Feeds a recorded trace to USBAuthorizationSystem.monitor_usb_devices
+
+    Each trace record becomes one 'resync' event, delivered when it is due:
+    at the recorded offset divided by speed (2.0 replays twice as fast,
+    0 replays as fast as the monitor can scan). The monitor then rescans and
+    sees the record's devices through attach(). wait_for_events returns
+    None once the trace is exhausted, which ends the monitor loop.
+
+    clock and sleep can be replaced, e.g. to replay against simulated time.
+    """
+
+    def __init__(self, records, speed=1.0, clock=time.monotonic, sleep=time.sleep):
+        self.records = iter(records)
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+        self.devices = []
+        self.start = None
+        self.pending = None
+        self.replayed = 0
+        self.finished = False
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        return cls(read_trace(path), **kwargs)
+
+    def attach(self, system):
+        """Make the system enumerate the replayed devices instead of real ones"""
+        system.get_connected_usb_devices = lambda: list(self.devices)
+        system.enumeration_source = lambda: 'replay'
+
+    def wait_for_events(self, timeout=None):
+        if self.finished:
+            return None
+        if self.pending is None:
+            self.pending = next(self.records, None)
+            if self.pending is None:
+                self.finished = True
+                return None
+        if self.start is None:
+            self.start = self.clock()
+
+        offset, devices = self.pending
+        if self.speed > 0:
+            delay = self.start + offset / self.speed - self.clock()
+            if timeout is not None and delay > timeout:
+                self.sleep(timeout)
+                return []
+            if delay > 0:
+                self.sleep(delay)
+
+        self.pending = None
+        self.devices = devices
+        self.replayed += 1
+        return [{'action': 'resync', 'devpath': '', 'subsystem': 'usb', 'devtype': 'usb_device',
+                 'product': ''}]
+
+    def close(self):
+        self.finished = True
+
+
+def generate_trace(path, events=10000, rate=1000.0, pool_size=20, authorized_devices=(),
+                   unauthorized_ratio=0.2, seed=0):
+    """Write a synthetic trace of events plug/unplug changes at rate changes per second
+
+    A pool of pool_size devices, each on its own port, is plugged in and out
+    at random. Devices are taken from authorized_devices (entries with
+    vendor_id/product_id/serial_number) except for roughly unauthorized_ratio
+    of the pool, which get ids that are not on any list. Returns the number
+    of records written.
+    """
+    rng = random.Random(seed)
+    authorized_devices = [device for device in authorized_devices
+                          if device.get('vendor_id') and device.get('product_id') not in ('', '*')]
+    pool = []
+    for i in range(pool_size):
+        if authorized_devices and rng.random() >= unauthorized_ratio:
+            entry = rng.choice(authorized_devices)
+            vendor_id, product_id = entry['vendor_id'], entry['product_id']
+            serial_number = entry.get('serial_number') or f"SYN{i:06d}"
+            name = f"{entry.get('manufacturer', '')} {entry.get('product_name', '')}".strip()
+        else:
+            vendor_id, product_id = f"f{rng.randrange(0x1000):03x}", f"{rng.randrange(0x10000):04x}"
+            serial_number = f"SYN{i:06d}"
+            name = ''
+        port_path = f"9-{i + 1}"
+        pool.append({
+            'vendor_id': vendor_id,
+            'product_id': product_id,
+            'serial_number': serial_number,
+            'device_name': name or f"Synthetic Device {i}",
+            'device_id': f"{vendor_id}:{product_id}",
+            'port_path': port_path,
+            'device_class': '00',
+            'interface_classes': [rng.choice(['03', '08', '0e', 'ff'])]
+        })
+
+    attached = {}
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({
+            'format': TRACE_FORMAT,
+            'version': TRACE_VERSION,
+            'host': 'synthetic',
+            'source': 'generated',
+            'recorded_at': datetime.now().isoformat(timespec='seconds')
+        }) + '\n')
+        for i in range(events):
+            device = rng.choice(pool)
+            if device['port_path'] in attached:
+                del attached[device['port_path']]
+            else:
+                attached[device['port_path']] = device
+            f.write(json.dumps({'t': round(i / rate, 6), 'devices': list(attached.values())}) + '\n')
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate USB monitor traces. Record one with 'usb_authorization.py --record-trace' "
+                    "and replay it with 'usb_authorization.py --replay-trace'.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate = subparsers.add_parser('generate', help="write a synthetic plug/unplug trace")
+    generate.add_argument('trace_file', help="trace file to write")
+    generate.add_argument('--events', type=int, default=10000, help="number of plug/unplug changes")
+    generate.add_argument('--rate', type=float, default=1000.0, help="changes per second")
+    generate.add_argument('--pool', type=int, default=20, help="number of distinct devices")
+    generate.add_argument('--authorized-csv', help="take most devices from this authorized list")
+    generate.add_argument('--unauthorized-ratio', type=float, default=0.2,
+                          help="fraction of devices that are not on the authorized list")
+    generate.add_argument('--seed', type=int, default=0)
+
+    info = subparsers.add_parser('info', help="summarize a trace")
+    info.add_argument('trace_file')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        authorized_devices = []
+        if args.authorized_csv:
+            from usb_allowlist import row_to_entry
+            with open(args.authorized_csv, 'r', newline='') as f:
+                authorized_devices = [row_to_entry(row) for row in csv.DictReader(f)]
+        count = generate_trace(args.trace_file, args.events, args.rate, args.pool, authorized_devices,
+                               args.unauthorized_ratio, args.seed)
+        print(f"Wrote {count} records to {args.trace_file}")
+    elif args.command == 'info':
+        try:
+            records = 0
+            duration = 0.0
+            most_attached = 0
+            for offset, devices in read_trace(args.trace_file):
+                records += 1
+                duration = offset
+                most_attached = max(most_attached, len(devices))
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"{records} records over {duration:.3f} seconds, at most {most_attached} devices attached")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+import os
+import random
+import time
+
+
+def scan_cpu_time():
+    """CPU used by this thread plus finished child processes such as lsusb"""
+    times = os.times()
+    return time.thread_time() + times.children_user + times.children_system
+
+
+class AdaptivePollScheduler:
+    """Decides how long to wait between polls when there are no hotplug events
+
+    While the device set stays the same the interval grows by backoff each
+    tick, up to max_interval; any change drops it straight back to
+    min_interval. Each delay is spread by +/- jitter (a fraction) so a fleet
+    of hosts does not poll in lockstep. If a tick used more CPU than
+    cpu_budget (a fraction of the interval), the interval is stretched until
+    it fits the budget, even past max_interval.
+
+    clock, sleep, cpu_clock and rng can be replaced for tests.
+    """
+
+    def __init__(self, min_interval=1.0, max_interval=30.0, backoff=1.5, jitter=0.1, cpu_budget=0.01,
+                 clock=time.monotonic, sleep=time.sleep, cpu_clock=scan_cpu_time, rng=None):
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("intervals must satisfy 0 < min_interval <= max_interval")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.cpu_budget = cpu_budget
+        self.clock = clock
+        self.sleep_function = sleep
+        self.cpu_clock = cpu_clock
+        self.rng = rng or random.Random()
+        self.interval = min_interval
+        self.last_tick_cpu = 0.0
+        self.next_poll = clock()
+
+    @classmethod
+    def fixed(cls, interval, **kwargs):
+        """Scheduler that always polls at the same interval"""
+        return cls(min_interval=interval, max_interval=interval, backoff=1, jitter=0, cpu_budget=0, **kwargs)
+
+    def describe(self):
+        if self.min_interval == self.max_interval:
+            return f"check interval: {self.min_interval:g} seconds"
+        return f"adaptive check interval: {self.min_interval:g}-{self.max_interval:g} seconds"
+
+    def update(self, changed, tick_cpu=0.0):
+        """Pick the next interval from whether the last tick saw a change and its CPU cost"""
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+        if self.cpu_budget and tick_cpu > self.interval * self.cpu_budget:
+            self.interval = tick_cpu / self.cpu_budget
+
+        delay = self.interval
+        if self.jitter:
+            delay *= 1 + self.rng.uniform(-self.jitter, self.jitter)
+        self.next_poll = self.clock() + delay
+        return delay
+
+    def run(self, tick):
+        """Run tick(), which returns True when devices changed, and schedule the next poll"""
+        cpu_start = self.cpu_clock()
+        changed = tick()
+        self.last_tick_cpu = self.cpu_clock() - cpu_start
+        self.update(changed, self.last_tick_cpu)
+        return changed
+
+    def wait(self):
+        """Sleep until the next poll is due"""
+        remaining = self.next_poll - self.clock()
+        if remaining > 0:
+            self.sleep_function(remaining)
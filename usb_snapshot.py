@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+from usb_allowlist import normalize_serial
+
+
+def device_location(device):
+    """Where a device is attached: sysfs port path, Windows instance id or lsusb address"""
+    return device.get('port_path') or device.get('instance_id') or device.get('usb_address') or ''
+
+
+def device_identity(device):
+    """Identity of one physical device: vendor, product, attachment point and serial"""
+    return (
+        device['vendor_id'],
+        device['product_id'],
+        device_location(device),
+        normalize_serial(device.get('serial_number'))
+    )
+
+
+class DeviceTracker:
+    """Snapshot of the attached devices, diffed against each new scan
+
+    Only devices that are currently attached are kept, so memory stays
+    bounded however long the monitor runs. Unplugging a device produces a
+    departure, and plugging it back in produces a new arrival.
+    """
+
+    def __init__(self):
+        self.devices = {}
+        self.ports = {}
+
+    def __len__(self):
+        return len(self.devices)
+
+    def _snapshot(self, connected_devices):
+        snapshot = {}
+        for device in connected_devices:
+            identity = device_identity(device)
+            # Without a location or serial two identical devices would share an
+            # identity, so count them apart
+            if identity in snapshot:
+                occurrence = 1
+                while identity + (occurrence,) in snapshot:
+                    occurrence += 1
+                identity = identity + (occurrence,)
+            snapshot[identity] = device
+        return snapshot
+
+    def update(self, connected_devices):
+        """Replace the snapshot with a full scan; returns (arrived, departed) device lists"""
+        snapshot = self._snapshot(connected_devices)
+        previous = self.devices
+
+        arrived = [snapshot[identity] for identity in snapshot.keys() - previous.keys()]
+        departed = [previous[identity] for identity in previous.keys() - snapshot.keys()]
+
+        self.devices = snapshot
+        self.ports = {device['port_path']: identity
+                      for identity, device in snapshot.items() if device.get('port_path')}
+        return arrived, departed
+
+    def add(self, device):
+        """Record one device reported by a hotplug event; returns (arrived, departed)"""
+        port_path = device.get('port_path')
+        previous = self.remove_port(port_path) if port_path else None
+
+        identity = device_identity(device)
+        self.devices[identity] = device
+        if port_path:
+            self.ports[port_path] = identity
+
+        if previous is not None and device_identity(previous) == identity:
+            # Same device announced again on the same port; nothing changed
+            return [], []
+        return [device], [previous] if previous is not None else []
+
+    def remove_port(self, port_path):
+        """Forget the device on a sysfs port; returns it, or None if nothing was there"""
+        identity = self.ports.pop(port_path, None)
+        if identity is None:
+            return None
+        return self.devices.pop(identity, None)
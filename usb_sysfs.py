@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+import os
+
+from usb_ids import get_resolver
+
+# Every USB device and interface the kernel knows about is linked from here
+SYSFS_USB_ROOT = '/sys/bus/usb/devices'
+
+# Common USB class codes (bDeviceClass / bInterfaceClass) by name
+USB_CLASS_CODES = {
+    'audio': '01',
+    'comm': '02',
+    'hid': '03',
+    'printer': '07',
+    'mass-storage': '08',
+    'hub': '09',
+    'video': '0e',
+    'wireless': 'e0',
+    'vendor': 'ff'
+}
+
+
+def class_code(value):
+    """Turn a class name ('mass-storage') or hex code ('8', '0x08') into a two digit code"""
+    value = value.strip().lower()
+    if value in USB_CLASS_CODES:
+        return USB_CLASS_CODES[value]
+    try:
+        return f"{int(value, 16):02x}"
+    except ValueError:
+        raise ValueError(f"unknown USB class '{value}'; use a hex code or one of "
+                         f"{', '.join(sorted(USB_CLASS_CODES))}")
+
+
+def read_sysfs_attribute(device_path, name, default=''):
+    """Read a single sysfs attribute file, returning default if it is missing"""
+    try:
+        with open(os.path.join(device_path, name), 'r', errors='replace') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def read_sysfs_device(device_path):
+    """Read one USB device directory from sysfs, or None if it is not a device"""
+    vendor_id = read_sysfs_attribute(device_path, 'idVendor').lower()
+    product_id = read_sysfs_attribute(device_path, 'idProduct').lower()
+    if not vendor_id or not product_id:
+        return None
+
+    port_path = os.path.basename(os.path.normpath(device_path))
+    manufacturer = read_sysfs_attribute(device_path, 'manufacturer')
+    product_name = read_sysfs_attribute(device_path, 'product')
+    if not manufacturer or not product_name:
+        # Many devices have no string descriptors; fall back to usb.ids
+        resolver = get_resolver()
+        manufacturer = manufacturer or resolver.vendor_name(vendor_id) or ''
+        product_name = product_name or resolver.product_name(vendor_id, product_id) or ''
+    device_name = f"{manufacturer} {product_name}".strip() or "Unknown USB Device"
+
+    return {
+        'vendor_id': vendor_id,
+        'product_id': product_id,
+        'serial_number': read_sysfs_attribute(device_path, 'serial') or "Unknown",
+        'manufacturer': manufacturer or "Unknown",
+        'product_name': product_name or "Unknown Device",
+        'device_name': device_name,
+        'device_id': f"{vendor_id}:{product_id}",
+        'busnum': read_sysfs_attribute(device_path, 'busnum'),
+        'devpath': read_sysfs_attribute(device_path, 'devpath'),
+        # Kernel name such as "1-1.2" (bus 1, port 1, then port 2 on the hub)
+        'port_path': port_path,
+        'device_class': read_sysfs_attribute(device_path, 'bDeviceClass').lower(),
+        'interface_classes': read_interface_classes(device_path, port_path)
+    }
+
+
+def read_interface_classes(device_path, port_path):
+    """Sorted class codes of a device's interfaces (e.g. ['03'] for a keyboard)"""
+    classes = set()
+    try:
+        entries = list(os.scandir(device_path))
+    except OSError:
+        return []
+
+    # Interfaces of the active configuration appear as "<port>:<config>.<interface>"
+    prefix = port_path + ':'
+    for entry in entries:
+        if entry.name.startswith(prefix):
+            interface_class = read_sysfs_attribute(entry.path, 'bInterfaceClass').lower()
+            if interface_class:
+                classes.add(interface_class)
+    return sorted(classes)
+
+
+def enumerate_usb_devices(sysfs_root=SYSFS_USB_ROOT):
+    """List connected USB devices by reading sysfs directly, without lsusb
+
+    Returns None when sysfs_root is not available so callers can fall back
+    to another detection method.
+    """
+    try:
+        entries = sorted(os.scandir(sysfs_root), key=lambda entry: entry.name)
+    except OSError:
+        return None
+
+    devices = []
+    for entry in entries:
+        # Names containing ':' ("1-1:1.0") are interfaces of a device, not devices
+        if ':' in entry.name:
+            continue
+        device = read_sysfs_device(entry.path)
+        if device:
+            devices.append(device)
+
+    return devices